@@ -14,6 +14,11 @@ from .vars import Var
 from aiohttp import web
 from .server import web_server
 from .utils.keepalive import ping_server
+from .bot.clients import initialize_clients
+from .utils.custom_dl import streamer
+from .utils.workers import run_workers
+from .utils.database import db
+from .utils.broadcast_helper import resume_broadcasts
 
 ppath = "WebStreamer/bot/plugins/*.py"
 files = glob.glob(ppath)
@@ -25,11 +30,17 @@ async def start_services():
     print('\n')
     print('------------------- Initalizing Telegram Bot -------------------')
     await StreamBot.start()
+    await initialize_clients()
+    await streamer.session_pool.start_health_checker()
+    if Var.WORKER_INDEX == 0:
+        await db.setup()
+        await resume_broadcasts(StreamBot, db)
     print('\n')
     print('---------------------- DONE ----------------------')
     print('\n')
     print('------------------- Importing -------------------')
-    for name in files:
+    # Other workers only stream, the bot commands are handled once by worker 0
+    for name in (files if Var.WORKER_INDEX == 0 else []):
         with open(name) as a:
             patt = Path(a.name)
             plugin_name = patt.stem.replace(".py", "")
@@ -45,21 +56,29 @@ async def start_services():
     app = web.AppRunner(await web_server())
     await app.setup()
     bind_address = "0.0.0.0" if Var.ON_HEROKU else Var.FQDN
-    await web.TCPSite(app, bind_address, Var.PORT).start()
+    await web.TCPSite(app, bind_address, Var.PORT, reuse_port=Var.PROCESSES > 1 or None).start()
     print('\n')
     print('----------------------- Service Started -----------------------')
     print('                        bot =>> {}'.format((await StreamBot.get_me()).first_name))
     print('                        server ip =>> {}:{}'.format(bind_address, Var.PORT))
+    if Var.PROCESSES > 1:
+        print('                        worker =>> {}/{}'.format(Var.WORKER_INDEX + 1, Var.PROCESSES))
     if Var.ON_HEROKU:
         print('                        app runnng on =>> {}'.format(Var.FQDN))
-    if Var.ON_HEROKU:
+    if Var.ON_HEROKU and Var.WORKER_INDEX == 0:
         print('------------------ Starting Keep Alive Service ------------------')
         print('\n')
         await asyncio.create_task(ping_server())
     print('---------------------------------------------------------------')
     await idle()
+    # Runs the app's on_cleanup hooks
+    await app.cleanup()
 
 if __name__ == '__main__':
+    if Var.PROCESSES > 1 and 'WORKER_INDEX' not in os.environ:
+        # Supervisor, each worker re-runs this module with its WORKER_INDEX set
+        run_workers(Var.PROCESSES)
+        sys.exit()
     try:
         loop.run_until_complete(start_services())
     except KeyboardInterrupt:
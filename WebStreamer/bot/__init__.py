@@ -4,10 +4,18 @@
 from pyrogram import Client
 from ..vars import Var
 
+# In multi-process mode only worker 0 receives updates, the other workers log in
+# with their own in-memory session and only stream files
 StreamBot = Client(
-    name=Var.SESSION_NAME,
+    name=Var.SESSION_NAME if Var.WORKER_INDEX == 0 else f"{Var.SESSION_NAME}_worker{Var.WORKER_INDEX}",
     api_id=Var.API_ID,
     api_hash=Var.API_HASH,
-    bot_token=Var.BOT_TOKEN
+    bot_token=Var.BOT_TOKEN,
+    no_updates=Var.WORKER_INDEX != 0,
+    in_memory=Var.WORKER_INDEX != 0
 )
 
+
+
+# Streaming clients keyed by index, 0 being StreamBot, see clients.initialize_clients
+multi_clients = {}
@@ -0,0 +1,57 @@
+# This file is a part of TG-FileStreamBot
+
+import asyncio
+import logging
+from os import environ
+from pyrogram import Client
+from WebStreamer.vars import Var
+from WebStreamer.bot import StreamBot, multi_clients
+from WebStreamer.utils.custom_dl import ByteStreamer, streamers, initialize_streamer
+
+
+def get_multi_tokens():
+    """Returns the extra bot tokens set as MULTI_TOKEN1, MULTI_TOKEN2, ... keyed by their number."""
+    tokens = {}
+    for name, token in environ.items():
+        if name.startswith("MULTI_TOKEN") and name[len("MULTI_TOKEN"):].isdigit() and token:
+            tokens[int(name[len("MULTI_TOKEN"):])] = token
+    return dict(sorted(tokens.items()))
+
+
+async def start_client(client_id: int, token: str):
+    try:
+        client = Client(
+            name=f"{Var.SESSION_NAME}_{client_id}_worker{Var.WORKER_INDEX}",
+            api_id=Var.API_ID,
+            api_hash=Var.API_HASH,
+            bot_token=token,
+            sleep_threshold=Var.SLEEP_THRESHOLD,
+            no_updates=True,
+            in_memory=True
+        )
+        await client.start()
+        return client_id, client
+    except Exception as e:
+        logging.error(f"Failed starting client {client_id}: {e}")
+        return client_id, None
+
+
+async def initialize_clients():
+    """
+    Starts StreamBot's streamer and one extra client per MULTI_TOKEN, each with its own ByteStreamer.
+    The extra clients only download files, they don't handle any updates.
+    """
+    multi_clients[0] = StreamBot
+    initialize_streamer(StreamBot)
+    tokens = get_multi_tokens()
+    if not tokens:
+        return
+    print('------------------- Starting Multi Clients -------------------')
+    clients = await asyncio.gather(*[start_client(client_id, token) for client_id, token in tokens.items()])
+    for client_id, client in clients:
+        if client is None:
+            continue
+        multi_clients[client_id] = client
+        streamers[client_id] = ByteStreamer(client)
+        await streamers[client_id].session_pool.start_health_checker()
+        print("Started client => " + str(client_id))
@@ -1,89 +1,64 @@
 # (c) @AbirHasan2005
 
-import os
 import time
 import string
 import random
-import asyncio
-import aiofiles
-import datetime
-from WebStreamer.utils.broadcast_helper import send_msg
-from WebStreamer.utils.database import Database
+from WebStreamer.utils.broadcast_helper import Broadcast, message_id_of, running_broadcasts, start_broadcast
+from WebStreamer.utils.database import db
 from WebStreamer.bot import StreamBot
 from WebStreamer.vars import Var
-from pyrogram import filters, Client
+from pyrogram import filters, enums, Client
 from pyrogram.types import Message
-db = Database(Var.DATABASE_URL, Var.SESSION_NAME)
-broadcast_ids = {}
 
 
 @StreamBot.on_message(filters.command("status") & filters.private & filters.user(Var.OWNER_ID))
 async def sts(c: Client, m: Message):
-    total_users = await db.total_users_count()
-    await m.reply_text(text=f"**Total Users in DB:** `{total_users}`", parse_mode="Markdown", quote=True)
+    total_users = await db.estimated_users_count()
+    await m.reply_text(text=f"**Total Users in DB:** `{total_users}`", parse_mode=enums.ParseMode.MARKDOWN, quote=True)
 
 
 @StreamBot.on_message(filters.command("broadcast") & filters.private & filters.user(Var.OWNER_ID) & filters.reply)
 async def broadcast_(c, m):
-    all_users = await db.get_all_users()
     broadcast_msg = m.reply_to_message
     while True:
         broadcast_id = ''.join([random.choice(string.ascii_letters) for i in range(3)])
-        if not broadcast_ids.get(broadcast_id):
+        if not running_broadcasts.get(broadcast_id):
             break
-    out = await m.reply_text(
-        text=f"Broadcast initiated! You will be notified with log file when all the users are notified."
-    )
-    start_time = time.time()
     total_users = await db.total_users_count()
-    done = 0
-    failed = 0
-    success = 0
-    broadcast_ids[broadcast_id] = dict(
+    broadcast = Broadcast(c, db, dict(
+        _id=broadcast_id,
+        chat_id=m.chat.id,
+        message_id=message_id_of(broadcast_msg),
+        reply_to=message_id_of(m),
         total=total_users,
-        current=done,
-        failed=failed,
-        success=success
+        started_at=time.time()
+    ))
+    # Saved before the first user so a restart resumes it
+    await db.save_broadcast(broadcast_id, broadcast.checkpoint())
+    start_broadcast(broadcast)
+    await m.reply_text(
+        text=f"Broadcast `{broadcast_id}` initiated! You will be notified with log file when all the users are notified.\n\n"
+             f"Use /broadcast_status to see its progress and `/broadcast_cancel {broadcast_id}` to stop it."
     )
-    async with aiofiles.open('broadcast.txt', 'w') as broadcast_log_file:
-        async for user in all_users:
-            sts, msg = await send_msg(
-                user_id=int(user['id']),
-                message=broadcast_msg
-            )
-            if msg is not None:
-                await broadcast_log_file.write(msg)
-            if sts == 200:
-                success += 1
-            else:
-                failed += 1
-            if sts == 400:
-                await db.delete_user(user['id'])
-            done += 1
-            if broadcast_ids.get(broadcast_id) is None:
-                break
-            else:
-                broadcast_ids[broadcast_id].update(
-                    dict(
-                        current=done,
-                        failed=failed,
-                        success=success
-                    )
-                )
-    if broadcast_ids.get(broadcast_id):
-        broadcast_ids.pop(broadcast_id)
-    completed_in = datetime.timedelta(seconds=int(time.time() - start_time))
-    await asyncio.sleep(3)
-    await out.delete()
-    if failed == 0:
-        await m.reply_text(
-            text=f"broadcast completed in `{completed_in}`\n\nTotal users {total_users}.\nTotal done {done}, {success} success and {failed} failed.",
-            quote=True
-        )
-    else:
-        await m.reply_document(
-            document='broadcast.txt',
-            caption=f"broadcast completed in `{completed_in}`\n\nTotal users {total_users}.\nTotal done {done}, {success} success and {failed} failed.",
-            quote=True
-        )
-    os.remove('broadcast.txt')
+
+
+@StreamBot.on_message(filters.command("broadcast_status") & filters.private & filters.user(Var.OWNER_ID))
+async def broadcast_status(c: Client, m: Message):
+    if not running_broadcasts:
+        await m.reply_text(text="No broadcast is running.", quote=True)
+        return
+    await m.reply_text(
+        text="\n".join(broadcast.progress() for broadcast in running_broadcasts.values()),
+        parse_mode=enums.ParseMode.MARKDOWN,
+        quote=True
+    )
+
+
+@StreamBot.on_message(filters.command("broadcast_cancel") & filters.private & filters.user(Var.OWNER_ID))
+async def broadcast_cancel(c: Client, m: Message):
+    broadcast = running_broadcasts.get(m.command[1]) if len(m.command) > 1 else None
+    if broadcast is None:
+        await m.reply_text(text="Usage: `/broadcast_cancel <broadcast id>` of a running broadcast.", quote=True)
+        return
+    broadcast.cancelled = True
+    await m.reply_text(text=f"Cancelling broadcast `{broadcast.id}`...", quote=True)
@@ -4,13 +4,12 @@ import urllib.parse
 from WebStreamer.bot import StreamBot
 from WebStreamer.vars import Var
 from WebStreamer.utils.human_readable import humanbytes
-from WebStreamer.utils.database import Database
+from WebStreamer.utils.database import db
+from WebStreamer.utils.membership import membership, BANNED
 from pyrogram import filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.errors import UserNotParticipant
 
-db = Database(Var.DATABASE_URL, Var.SESSION_NAME)
-
 
 def get_media_file_size(m):
     media = m.video or m.audio or m.document
@@ -30,8 +29,7 @@ def get_media_file_name(m):
 
 @StreamBot.on_message(filters.command('start') & filters.private)
 async def start(b, m):
-    if not await db.is_user_exist(m.from_user.id):
-        await db.add_user(m.from_user.id)
+    if await db.add_user_if_new(m.from_user.id):
         await b.send_message(
             Var.BIN_CHANNEL,
             f"#NEW_USER: \n\nNew User [{m.from_user.first_name}](tg://user?id={m.from_user.id}) Started !!"
@@ -40,8 +38,8 @@ async def start(b, m):
     if usr_cmd == "/start":
         if Var.UPDATES_CHANNEL != "None":
             try:
-                user = await b.get_chat_member(Var.UPDATES_CHANNEL, m.chat.id)
-                if user.status == "kicked":
+                status = await membership.check(b, m.chat.id, retry=True)
+                if status == BANNED:
                     await b.send_message(
                         chat_id=m.chat.id,
                         text="Sorry Sir, You are Banned to use me. Contact my [Support Group](https://t.me/JoinOT).",
@@ -83,8 +81,8 @@ async def start(b, m):
     else:
         if Var.UPDATES_CHANNEL != "None":
             try:
-                user = await b.get_chat_member(Var.UPDATES_CHANNEL, m.chat.id)
-                if user.status == "kicked":
+                status = await membership.check(b, m.chat.id, retry=True)
+                if status == BANNED:
                     await b.send_message(
                         chat_id=m.chat.id,
                         text="Sorry Sir, You are Banned to use me. Contact my [Support Group](https://t.me/JoinOT).",
@@ -139,16 +137,15 @@ async def start(b, m):
 
 @StreamBot.on_message(filters.command('help') & filters.private)
 async def help_handler(bot, message):
-    if not await db.is_user_exist(message.from_user.id):
-        await db.add_user(message.from_user.id)
+    if await db.add_user_if_new(message.from_user.id):
         await bot.send_message(
             Var.BIN_CHANNEL,
             f"#NEW_USER: \n\nNew User [{message.from_user.first_name}](tg://user?id={message.from_user.id}) Started !!"
         )
     if Var.UPDATES_CHANNEL != "None":
         try:
-            user = await bot.get_chat_member(Var.UPDATES_CHANNEL, message.chat.id)
-            if user.status == "kicked":
+            status = await membership.check(bot, message.chat.id, retry=True)
+            if status == BANNED:
                 await bot.send_message(
                     chat_id=message.chat.id,
                     text="Sorry Sir, You are Banned to use me. Contact my [Support Group](https://t.me/JoinOT).",
@@ -1,15 +1,17 @@
 # (c) @EverythingSuckz | @AbirHasan2005
 
-import asyncio
 import urllib.parse
 from WebStreamer.bot import StreamBot
-from WebStreamer.utils.database import Database
+from WebStreamer.utils.database import db
+from WebStreamer.utils.ingest import Batch, IngestQueue
+from WebStreamer.utils.broadcast_helper import message_id_of
+from WebStreamer.utils.custom_dl import ByteStreamer, streamer
+from WebStreamer.utils.membership import membership, BANNED
 from WebStreamer.utils.human_readable import humanbytes
 from WebStreamer.vars import Var
 from pyrogram import Client, filters, enums
-from pyrogram.errors import FloodWait, UserNotParticipant
+from pyrogram.errors import UserNotParticipant
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-db = Database(Var.DATABASE_URL, Var.SESSION_NAME)
 
 
 def get_media_file_size(m):
@@ -43,18 +45,21 @@ def is_streamable(m):
     return False
 
 
+PRIVATE = "private"
+CHANNEL = "channel"
+
+
 @StreamBot.on_message(filters.private & (filters.document | filters.video | filters.audio), group=4)
 async def private_receive_handler(c: Client, m: Message):
-    if not await db.is_user_exist(m.from_user.id):
-        await db.add_user(m.from_user.id)
+    if await db.add_user_if_new(m.from_user.id):
         await c.send_message(
             Var.BIN_CHANNEL,
             f"#NEW_USER: \n\nNew User [{m.from_user.first_name}](tg://user?id={m.from_user.id}) Started !!"
         )
     if Var.UPDATES_CHANNEL != "None":
         try:
-            user = await c.get_chat_member(Var.UPDATES_CHANNEL, m.chat.id)
-            if user.status == "kicked":
+            status = await membership.check(c, m.chat.id)
+            if status == BANNED:
                 await c.send_message(
                     chat_id=m.chat.id,
                     text="Sorry Sir, You are Banned to use me. Contact my [Support Group](https://t.me/JoinOT).",
@@ -83,75 +88,8 @@ async def private_receive_handler(c: Client, m: Message):
                 parse_mode="markdown",
                 disable_web_page_preview=True)
             return
-    try:
-        log_msg = await m.forward(chat_id=Var.BIN_CHANNEL)
-    
-        file_name = get_media_file_name(m)
-        file_size = humanbytes(get_media_file_size(m))
-        
-        # Fix for compatibility with different Pyrogram versions
-        if hasattr(log_msg, 'message_id'):
-            msg_id = log_msg.message_id
-        elif hasattr(log_msg, 'id'):
-            msg_id = log_msg.id
-        else:
-            # Fallback with debug info
-            print("Available attributes:", dir(log_msg))
-            msg_id = getattr(log_msg, 'id', 0)
-        
-        base_url = "https://{}".format(Var.FQDN) if Var.ON_HEROKU or Var.NO_PORT else \
-            "http://{}:{}".format(Var.FQDN, Var.PORT)
-            
-        stream_link = f"{base_url}/{msg_id}/{file_name}"
-        download_link = f"{stream_link}?download=1"
-        
-        is_media_streamable = is_streamable(m)
-        
-        # Customize the message based on the media type
-        if is_media_streamable:
-            msg_text = "Bruh! 😁\nYour Link Generated! 🤓\n\n📂 **File Name:** `{}`\n**File Size:** `{}`\n\n🎬 **Stream Link:** `{}`\n📥 **Download Link:** `{}`"
-            reply_markup = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎬 Stream Now", url=stream_link)],
-                [InlineKeyboardButton("📥 Download Now", url=download_link)]
-            ])
-        else:
-            msg_text = "Bruh! 😁\nYour Link Generated! 🤓\n\n📂 **File Name:** `{}`\n**File Size:** `{}`\n\n📥 **Download Link:** `{}`"
-            reply_markup = InlineKeyboardMarkup([[
-                InlineKeyboardButton("📥 Download Now", url=download_link)
-            ]])
-        
-        await log_msg.reply_text(
-            text=f"Requested by [{m.from_user.first_name}](tg://user?id={m.from_user.id})\n**User ID:** `{m.from_user.id}`\n**Stream Link:** {stream_link}\n**Download Link:** {download_link}",
-            disable_web_page_preview=True,
-            parse_mode=enums.ParseMode.MARKDOWN,
-            quote=True
-        )
-        
-        # Send appropriate message based on media type
-        if is_media_streamable:
-            await m.reply_text(
-                text=msg_text.format(file_name, file_size, stream_link, download_link),
-                reply_markup=reply_markup,
-                parse_mode=enums.ParseMode.MARKDOWN,
-                quote=True
-            )
-        else:
-            await m.reply_text(
-                text=msg_text.format(file_name, file_size, download_link),
-                reply_markup=reply_markup,
-                parse_mode=enums.ParseMode.MARKDOWN,
-                quote=True
-            )
-        
-    except FloodWait as e:
-        print(f"Sleeping for {str(e.x)}s")
-        await asyncio.sleep(e.x)
-        await c.send_message(
-            chat_id=Var.BIN_CHANNEL,
-            text=f"Got FloodWait of {str(e.x)}s from [{m.from_user.first_name}](tg://user?id={m.from_user.id})\n\n**User ID:** `{str(m.from_user.id)}`",
-            disable_web_page_preview=True,
-            parse_mode=enums.ParseMode.MARKDOWN
-        )
+    # Forwarding and replying happen in the ingestion queue, off the update workers
+    await ingest_queue.submit(c, m, PRIVATE)
 
 
 @StreamBot.on_message(filters.channel & (filters.document | filters.video), group=-1)
@@ -159,48 +97,94 @@ async def channel_receive_handler(bot, broadcast):
     if int(broadcast.chat.id) in Var.BANNED_CHANNELS:
         await bot.leave_chat(broadcast.chat.id)
         return
+    await ingest_queue.submit(bot, broadcast, CHANNEL)
+
+
+def get_links(log_msg, m):
+    file_name = get_media_file_name(m)
+    base_url = "https://{}".format(Var.FQDN) if Var.ON_HEROKU or Var.NO_PORT else \
+        "http://{}:{}".format(Var.FQDN, Var.PORT)
+    stream_link = f"{base_url}/{message_id_of(log_msg)}/{file_name}"
+    download_link = f"{stream_link}?download=1"
+    return stream_link, download_link
+
+
+async def process_uploads(queue: IngestQueue, batch: Batch):
+    """Forwards a batch of uploads of one chat to the BIN_CHANNEL and answers with their links."""
+    c = batch.client
+    messages = sorted(batch.messages, key=message_id_of)
+    chat = messages[0].chat
     try:
-        log_msg = await broadcast.forward(chat_id=Var.BIN_CHANNEL)
-        
-        file_name = get_media_file_name(broadcast)
-        
-        base_url = "https://{}".format(Var.FQDN) if Var.ON_HEROKU or Var.NO_PORT else \
-            "http://{}:{}".format(Var.FQDN, Var.PORT)
-            
-        stream_link = f"{base_url}/{log_msg.message_id}/{file_name}"
-        download_link = f"{stream_link}?download=1"
-        
-        is_media_streamable = is_streamable(broadcast)
-        
-        await log_msg.reply_text(
-            text=f"**Channel Name:** `{broadcast.chat.title}`\n**Channel ID:** `{broadcast.chat.id}`\n**Stream Link:** {stream_link}\n**Download Link:** {download_link}",
-            quote=True,
-            parse_mode="Markdown"
+        log_msgs = await queue.call(
+            c.forward_messages, Var.BIN_CHANNEL, chat.id, [message_id_of(m) for m in messages]
         )
-        
-        if is_media_streamable:
-            await bot.edit_message_reply_markup(
-                chat_id=broadcast.chat.id,
-                message_id=broadcast.message_id,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🎬 Stream Now", url=stream_link)],
-                    [InlineKeyboardButton("📥 Download", url=download_link)]
-                ])
-            )
+        if not isinstance(log_msgs, list):
+            log_msgs = [log_msgs]
+        links = [get_links(log_msg, m) for log_msg, m in zip(log_msgs, messages)]
+        # Index the files now so streaming them doesn't need get_messages
+        for log_msg in log_msgs:
+            properties = ByteStreamer.parse_file_properties(log_msg)
+            if properties is not None:
+                await streamer.index_file(message_id_of(log_msg), properties)
+
+        # One log entry for the whole batch, replying to its first file
+        if batch.kind == PRIVATE:
+            m = messages[0]
+            header = f"Requested by [{m.from_user.first_name}](tg://user?id={m.from_user.id})\n**User ID:** `{m.from_user.id}`"
         else:
-            await bot.edit_message_reply_markup(
-                chat_id=broadcast.chat.id,
-                message_id=broadcast.message_id,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📥 Download", url=download_link)]
+            header = f"**Channel Name:** `{chat.title}`\n**Channel ID:** `{chat.id}`"
+        await queue.call(
+            log_msgs[0].reply_text,
+            text=header + "".join(
+                f"\n**Stream Link:** {stream_link}\n**Download Link:** {download_link}"
+                for stream_link, download_link in links
+            ),
+            disable_web_page_preview=True,
+            parse_mode=enums.ParseMode.MARKDOWN,
+            quote=True
+        )
+
+        for m, (stream_link, download_link) in zip(messages, links):
+            if is_streamable(m):
+                reply_markup = InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🎬 Stream Now", url=stream_link)],
+                    [InlineKeyboardButton("📥 Download Now" if batch.kind == PRIVATE else "📥 Download", url=download_link)]
                 ])
+            else:
+                reply_markup = InlineKeyboardMarkup([[
+                    InlineKeyboardButton("📥 Download Now" if batch.kind == PRIVATE else "📥 Download", url=download_link)
+                ]])
+            if batch.kind == CHANNEL:
+                await queue.call(
+                    c.edit_message_reply_markup,
+                    chat_id=chat.id,
+                    message_id=message_id_of(m),
+                    reply_markup=reply_markup
+                )
+                continue
+            file_name = get_media_file_name(m)
+            file_size = humanbytes(get_media_file_size(m))
+            # Customize the message based on the media type
+            if is_streamable(m):
+                msg_text = "Bruh! 😁\nYour Link Generated! 🤓\n\n📂 **File Name:** `{}`\n**File Size:** `{}`\n\n🎬 **Stream Link:** `{}`\n📥 **Download Link:** `{}`"
+                text = msg_text.format(file_name, file_size, stream_link, download_link)
+            else:
+                msg_text = "Bruh! 😁\nYour Link Generated! 🤓\n\n📂 **File Name:** `{}`\n**File Size:** `{}`\n\n📥 **Download Link:** `{}`"
+                text = msg_text.format(file_name, file_size, download_link)
+            await queue.call(
+                m.reply_text,
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode=enums.ParseMode.MARKDOWN,
+                quote=True
             )
-    except FloodWait as w:
-        print(f"Sleeping for {str(w.x)}s")
-        await asyncio.sleep(w.x)
-        await bot.send_message(chat_id=Var.BIN_CHANNEL,
-                             text=f"Got FloodWait of {str(w.x)}s from {broadcast.chat.title}\n\n**Channel ID:** `{str(broadcast.chat.id)}`",
-                             disable_web_page_preview=True, parse_mode="Markdown")
     except Exception as e:
-        await bot.send_message(chat_id=Var.BIN_CHANNEL, text=f"#ERROR_TRACEBACK: `{e}`", disable_web_page_preview=True, parse_mode="Markdown")
-        print(f"Can't Edit Broadcast Message!\nError: {e}")
+        if batch.kind == CHANNEL:
+            await queue.call(c.send_message, chat_id=Var.BIN_CHANNEL, text=f"#ERROR_TRACEBACK: `{e}`",
+                             disable_web_page_preview=True, parse_mode=enums.ParseMode.MARKDOWN)
+            print(f"Can't Edit Broadcast Message!\nError: {e}")
+        else:
+            raise
+
+
+ingest_queue = IngestQueue(process_uploads)
@@ -5,9 +5,20 @@
 
 from aiohttp import web
 from .stream_routes import routes
+from WebStreamer.utils.chunk_origin import chunk_origin
+from WebStreamer.utils.custom_dl import streamers
+
+
+async def close_services(app):
+    """Closes the HTTP client sessions and the media sessions opened on behalf of the routes."""
+    if chunk_origin is not None:
+        await chunk_origin.close()
+    for byte_streamer in streamers.values():
+        await byte_streamer.session_pool.close()
 
 
 async def web_server():
     web_app = web.Application(client_max_size=30000000)
     web_app.add_routes(routes)
+    web_app.on_cleanup.append(close_services)
     return web_app
\ No newline at end of file
@@ -0,0 +1,137 @@
+# This file is a part of TG-FileStreamBot
+
+import os
+import gzip
+import html
+import hashlib
+import urllib.parse
+from string import Template
+from typing import Dict, NamedTuple, Optional, Union
+from pyrogram.file_id import FileId
+from WebStreamer.vars import Var
+from WebStreamer.utils.cache import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+
+VIDEO_PLAYER = Template(
+    '<video class="video-player" controls autoplay data-seek-index="$seek_index"$poster>\n'
+    '                <source src="$stream_url" type="$mime_type">\n'
+    '                Your browser does not support the video tag.\n'
+    '            </video>'
+)
+AUDIO_PLAYER = Template(
+    '<audio class="audio-player" controls autoplay>\n'
+    '                <source src="$stream_url" type="$mime_type">\n'
+    '                Your browser does not support the audio tag.\n'
+    '            </audio>'
+)
+UNSUPPORTED = Template('<p>This file type ($mime_type) is not supported for streaming playback.</p>')
+
+
+class StaticAsset(NamedTuple):
+    content_type: str
+    etag: str
+    # Body per Content-Encoding, "identity" included
+    bodies: Dict[str, bytes]
+
+
+class StaticAssets:
+    """
+    Files of the static directory, loaded and compressed once.
+
+    Assets are served under a name containing their hash, so they can be cached
+    by browsers forever and a changed file gets a new URL.
+    """
+
+    CONTENT_TYPES = {".css": "text/css", ".js": "application/javascript"}
+
+    def __init__(self, directory: str = STATIC_DIR):
+        self.assets: Dict[str, StaticAsset] = {}
+        self.urls: Dict[str, str] = {}
+        for name in sorted(os.listdir(directory)):
+            root, extension = os.path.splitext(name)
+            if extension not in self.CONTENT_TYPES:
+                continue
+            with open(os.path.join(directory, name), "rb") as f:
+                body = f.read()
+            digest = hashlib.sha256(body).hexdigest()[:12]
+            bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                bodies["br"] = brotli.compress(body)
+            hashed_name = f"{root}.{digest}{extension}"
+            self.assets[hashed_name] = StaticAsset(self.CONTENT_TYPES[extension], digest, bodies)
+            self.urls[name] = f"/static/{hashed_name}"
+
+    def get(self, hashed_name: str) -> Optional[StaticAsset]:
+        return self.assets.get(hashed_name)
+
+    @staticmethod
+    def pick_encoding(asset: StaticAsset, accept_encoding: str) -> str:
+        """Returns the smallest variant accepted by the client."""
+        accepted = {
+            token.split(";")[0].strip().lower() for token in accept_encoding.split(",")
+            if not token.strip().endswith(";q=0")
+        }
+        for encoding in ("br", "gzip"):
+            if encoding in asset.bodies and encoding in accepted:
+                return encoding
+        return "identity"
+
+
+class RenderedPage(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class PlayerRenderer:
+    """Renders player pages from the template compiled at startup, caching them per message_id."""
+
+    def __init__(self, static: StaticAssets, template_path: str = os.path.join(TEMPLATES_DIR, "player.html")):
+        with open(template_path, encoding="utf-8") as f:
+            self.template = Template(f.read())
+        self.stylesheet = static.urls["player.css"]
+        self.pages = TTLCache(maxsize=Var.METADATA_CACHE_SIZE, ttl=Var.METADATA_CACHE_TTL)
+
+    def render(self, message_id: int, file_properties: Dict[str, Union[FileId, str, int]]) -> RenderedPage:
+        file_name = file_properties.get("file_name", "Unknown")
+        mime_type = file_properties.get("mime_type", "application/octet-stream")
+        media_type = file_properties.get("media_type", "document")
+
+        # Relative URLs keep the page independent of the host it was requested on
+        stream_url = f"/{message_id}/{urllib.parse.quote(file_name)}"
+        values = {
+            "stream_url": html.escape(stream_url),
+            "mime_type": html.escape(mime_type),
+            # Maps seek times to byte offsets, see /index/{message_id}
+            "seek_index": f"/index/{message_id}",
+            "poster": f' poster="/thumb/{message_id}"' if file_properties.get("thumb_size") else "",
+        }
+        if media_type == "video" or mime_type.startswith("video/"):
+            player = VIDEO_PLAYER.substitute(values)
+        elif media_type == "audio" or mime_type.startswith("audio/"):
+            player = AUDIO_PLAYER.substitute(values)
+        else:
+            player = UNSUPPORTED.substitute(values)
+
+        body = self.template.substitute(
+            file_name=html.escape(file_name),
+            stylesheet=html.escape(self.stylesheet),
+            player=player,
+            download_url=html.escape(f"{stream_url}?download=1"),
+        ).encode("utf-8")
+        page = RenderedPage(body, hashlib.sha256(body).hexdigest()[:16])
+        self.pages.set(message_id, page)
+        return page
+
+    def get(self, message_id: int) -> Optional[RenderedPage]:
+        return self.pages.get(message_id)
+
+
+static_assets = StaticAssets()
+player_renderer = PlayerRenderer(static_assets)
@@ -1,13 +1,25 @@
 # (c) @AbirHasan2005
 
-import math
+import zlib
+import asyncio
 import logging
+import secrets
 import time
 from WebStreamer.vars import Var
 from aiohttp import web
 from WebStreamer.bot import StreamBot
-from WebStreamer.utils.custom_dl import streamer
+from WebStreamer.utils.custom_dl import streamer, select_streamer
+from WebStreamer.utils.exceptions import ChunkFetchError, FileNotFound
+from WebStreamer.utils.range_planner import parse_range, RangeNotSatisfiable
+from WebStreamer.utils import metrics
+from WebStreamer.utils.metrics import ACTIVE_STREAMS, BYTES_SERVED
+from WebStreamer.utils.scheduler import scheduler, DOWNLOAD, PLAYBACK
+from WebStreamer.server.player import player_renderer, static_assets
+from WebStreamer.utils.chunk_origin import CHUNK_SIZE, chunk_length, chunk_origin
+from WebStreamer.utils.container_index import container_format, seek
+from WebStreamer.utils.zip_stream import ZipBundle, unique_names
 import urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
 
 # Import the time_format module
 try:
@@ -46,14 +58,296 @@ except ImportError:
     StartTime = time.time()
 
 routes = web.RouteTableDef()
+# Fire and forget tasks started by requests, referenced until they finish
+background_tasks = set()
+
+
+class CachedFileResponse(web.FileResponse):
+    """FileResponse that keeps the ETag and Last-Modified of the Telegram file instead of the cache file's."""
+
+    @property
+    def etag(self):
+        return web.FileResponse.etag.fget(self)
+
+    @etag.setter
+    def etag(self, value):
+        pass
+
+    @property
+    def last_modified(self):
+        return web.FileResponse.last_modified.fget(self)
+
+    @last_modified.setter
+    def last_modified(self, value):
+        pass
+
+
+def get_etag(file_properties) -> str:
+    """Strong ETag of a file, its unique id doesn't change for the lifetime of the file."""
+    return f"{file_properties.get('unique_id')}-{file_properties.get('file_size', 0):x}"
+
+
+def is_not_modified(request, etag: str, last_modified: int) -> bool:
+    """Evaluates If-None-Match, falling back to If-Modified-Since when it is absent."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        # Weak comparison, W/ prefixes are ignored
+        return '*' in tags or any(tag[2:].strip('"') == etag if tag.startswith('W/') else tag.strip('"') == etag
+                                  for tag in tags)
+    if_modified_since = request.if_modified_since
+    return bool(last_modified and if_modified_since and last_modified <= if_modified_since.timestamp())
+
+
+def if_range_matches(request, etag: str, last_modified: int) -> bool:
+    """Returns False when If-Range says the client's copy is outdated, meaning the whole file must be sent."""
+    if_range = request.headers.get('If-Range')
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', 'W/')):
+        # Strong comparison, weak tags never match
+        return if_range == f'"{etag}"'
+    try:
+        return bool(last_modified) and parsedate_to_datetime(if_range).timestamp() == last_modified
+    except (TypeError, ValueError):
+        return False
 
 @routes.get("/", allow_head=True)
 async def root_route_handler(request):
     return web.json_response({"status": "running",
                              "maintained_by": "AbirHasan2005",
                              "uptime": get_readable_time(time.time() - StartTime),
+                             "disk_cache": streamer.disk_cache.stats(),
+                             "thumbnails": streamer.thumbnails.stats(),
                              "telegram_bot": '@'+(await StreamBot.get_me()).username})
 
+@routes.get("/metrics")
+async def metrics_handler(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"Cache-Control": "no-store"})
+
+@routes.get("/static/{name}", allow_head=True)
+async def static_handler(request):
+    asset = static_assets.get(request.match_info['name'])
+    if asset is None:
+        raise web.HTTPNotFound
+    encoding = static_assets.pick_encoding(asset, request.headers.get('Accept-Encoding', ''))
+    headers = {
+        # The name contains the hash of the content, it never changes
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'ETag': f'"{asset.etag}"',
+        'Vary': 'Accept-Encoding',
+    }
+    if is_not_modified(request, asset.etag, 0):
+        return web.Response(status=304, headers=headers)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return web.Response(body=asset.bodies[encoding], content_type=asset.content_type, headers=headers)
+
+@routes.get("/player/{message_id}", allow_head=True)
+async def player_handler(request):
+    try:
+        message_id = int(request.match_info['message_id'])
+        return await serve_player_page(request, message_id)
+    except ValueError as e:
+        logging.error(e)
+        raise web.HTTPNotFound
+
+async def serve_player_page(request, message_id):
+    page = player_renderer.get(message_id)
+    if page is None:
+        try:
+            file_properties = await select_streamer().get_file_properties(message_id)
+        except FileNotFound:
+            raise web.HTTPNotFound
+        except Exception as e:
+            logging.error(f"Error in player page: {e}")
+            raise web.HTTPNotFound
+        page = player_renderer.render(message_id, file_properties)
+    headers = {'ETag': f'"{page.etag}"', 'Cache-Control': 'public, max-age=3600'}
+    if is_not_modified(request, page.etag, 0):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=page.body, content_type='text/html', charset='utf-8', headers=headers)
+
+@routes.get("/c/{message_id}/{chunk_index}", allow_head=True)
+async def chunk_handler(request):
+    try:
+        message_id = int(request.match_info['message_id'])
+        index = int(request.match_info['chunk_index'])
+    except ValueError:
+        raise web.HTTPNotFound
+    return await chunk_streamer(request, message_id, index)
+
+async def chunk_streamer(request, message_id, index):
+    """Serves one aligned chunk, the same URL always has the same content so any cache may keep it."""
+    tg_connect = select_streamer()
+    try:
+        file_properties = await tg_connect.get_file_properties(message_id)
+    except FileNotFound:
+        raise web.HTTPNotFound
+    length = chunk_length(file_properties["file_size"], index)
+    if index < 0 or not length:
+        raise web.HTTPNotFound
+    etag = f"{get_etag(file_properties)}-{index}"
+    headers = {
+        'Content-Type': 'application/octet-stream',
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'ETag': f'"{etag}"',
+    }
+    if is_not_modified(request, etag, 0):
+        return web.Response(status=304, headers=headers)
+    if request.method == 'HEAD':
+        headers['Content-Length'] = str(length)
+        return web.Response(headers=headers)
+    flow = scheduler.open_flow(request.remote, PLAYBACK)
+    try:
+        data = await tg_connect.yield_file(message_id, index * CHUNK_SIZE, CHUNK_SIZE, 0, length, flow)
+    except ChunkFetchError as e:
+        logging.warning(f"Couldn't serve chunk {index} of {message_id}: {e}")
+        raise web.HTTPBadGateway
+    finally:
+        scheduler.close_flow(flow)
+    BYTES_SERVED.inc("chunk", amount=len(data))
+    return web.Response(body=bytes(data), headers=headers)
+
+@routes.get("/thumb/{message_id}", allow_head=True)
+async def thumbnail_handler(request):
+    try:
+        message_id = int(request.match_info['message_id'])
+    except ValueError:
+        raise web.HTTPNotFound
+    tg_connect = select_streamer()
+    try:
+        file_properties = await tg_connect.get_file_properties(message_id)
+    except FileNotFound:
+        raise web.HTTPNotFound
+    etag = f"{file_properties.get('unique_id')}-thumb"
+    headers = {'Cache-Control': 'public, max-age=31536000, immutable', 'ETag': f'"{etag}"'}
+    if is_not_modified(request, etag, 0):
+        return web.Response(status=304, headers=headers)
+    try:
+        data = await tg_connect.get_thumbnail(message_id)
+    except ChunkFetchError as e:
+        logging.warning(f"Couldn't fetch the thumbnail of {message_id}: {e}")
+        raise web.HTTPBadGateway
+    if data is None:
+        raise web.HTTPNotFound(text="This file has no thumbnail")
+    return web.Response(body=data, content_type='image/jpeg', headers=headers)
+
+@routes.get("/index/{message_id}")
+async def container_index_handler(request):
+    """Seek index of a video, with ?t=<seconds> the keyframe to start from for that time."""
+    try:
+        message_id = int(request.match_info['message_id'])
+        seconds = float(request.query['t']) if 't' in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest
+    tg_connect = select_streamer()
+    try:
+        file_properties = await tg_connect.get_file_properties(message_id)
+        index = await tg_connect.get_container_index(message_id)
+    except FileNotFound:
+        raise web.HTTPNotFound
+    if not index:
+        raise web.HTTPNotFound(text="No seek index for this file")
+    headers = {'Cache-Control': 'public, max-age=604800', 'ETag': f'"{get_etag(file_properties)}-index"'}
+    if seconds is None:
+        return web.json_response({
+            "format": index["format"],
+            "duration": index["duration"],
+            "index_offset": index["index_offset"],
+            "index_size": index["index_size"],
+            "keyframes": index["keyframes"],
+        }, headers=headers)
+    time_, offset = seek(index, seconds)
+    return web.json_response({"time": time_, "offset": offset}, headers=headers)
+
+@routes.get("/bundle", allow_head=True)
+async def bundle_handler(request):
+    """ZIP archive of several files, /bundle?ids=12,13,14&name=album"""
+    try:
+        message_ids = [int(x) for x in request.query.get('ids', '').split(',') if x.strip()]
+    except ValueError:
+        raise web.HTTPBadRequest(text="ids must be comma separated message ids")
+    if not message_ids:
+        raise web.HTTPBadRequest(text="No message ids given")
+    if len(message_ids) > Var.BUNDLE_MAX_FILES:
+        raise web.HTTPBadRequest(text=f"A bundle holds at most {Var.BUNDLE_MAX_FILES} files")
+    return await bundle_streamer(request, message_ids, request.query.get('name', 'bundle'))
+
+async def bundle_streamer(request, message_ids, bundle_name):
+    """
+    Streams the files as a stored ZIP archive. Sizes are known from the metadata,
+    so the exact Content-Length is sent upfront and only the prefetch window is
+    held in memory.
+    """
+    tg_connect = select_streamer()
+    try:
+        files = await asyncio.gather(*(tg_connect.get_file_properties(message_id) for message_id in message_ids))
+    except FileNotFound:
+        raise web.HTTPNotFound
+    names = unique_names([
+        properties.get("file_name") or f"file_{message_id}" for message_id, properties in zip(message_ids, files)
+    ])
+    bundle = ZipBundle([
+        (name, properties.get("file_size", 0), properties.get("date") or int(time.time()))
+        for name, properties in zip(names, files)
+    ])
+    headers = {
+        'Content-Type': 'application/zip',
+        'Content-Length': str(bundle.content_length),
+        'Content-Disposition': f'attachment; filename="{urllib.parse.quote(bundle_name)}.zip"',
+        'Cache-Control': 'public, max-age=604800',
+    }
+    if request.method == 'HEAD':
+        return web.Response(headers=headers)
+
+    for properties in files:
+        dc_id = properties["file_id"].dc_id
+        if not tg_connect.dc_available(dc_id):
+            raise web.HTTPServiceUnavailable(
+                text=f"DC {dc_id} is temporarily unavailable", headers={'Retry-After': str(Var.BREAKER_COOLDOWN)}
+            )
+
+    response = web.StreamResponse(headers=headers)
+    await response.prepare(request)
+
+    # One window for the whole archive, the first parts of the next member are
+    # fetched while the end of the current one is written
+    flow = scheduler.open_flow(request.remote, DOWNLOAD)
+    parts = (
+        (message_id, part)
+        for message_id, properties in zip(message_ids, files) if properties.get("file_size")
+        for part in tg_connect.plan_file(properties, 0, properties["file_size"] - 1)
+    )
+    chunks = tg_connect.prefetch_parts(parts, flow=flow)
+    crcs = []
+    tg_connect.active_streams += 1
+    try:
+        for member in bundle.members:
+            await response.write(bundle.local_header(member))
+            crc, remaining = 0, member.size
+            while remaining > 0:
+                chunk = await chunks.__anext__()
+                crc = zlib.crc32(chunk, crc)
+                remaining -= len(chunk)
+                await response.write(chunk)
+                BYTES_SERVED.inc("bundle", amount=len(chunk))
+            crcs.append(crc)
+            await response.write(bundle.data_descriptor(member, crc))
+        await response.write(bundle.central_directory(crcs))
+    except (ChunkFetchError, StopAsyncIteration) as e:
+        logging.warning(f"Aborting bundle of {message_ids}: {e!r}")
+        response.force_close()
+        if request.transport is not None:
+            request.transport.close()
+    finally:
+        await chunks.aclose()
+        tg_connect.active_streams -= 1
+        scheduler.close_flow(flow)
+    return response
+
 @routes.get("/{message_id}", allow_head=True)
 async def stream_handler(request):
     try:
@@ -73,171 +367,56 @@ async def stream_handler_with_name(request):
         logging.error(e)
         raise web.HTTPNotFound
 
-@routes.get("/player/{message_id}", allow_head=True)
-async def player_handler(request):
-    try:
-        message_id = int(request.match_info['message_id'])
-        return await serve_player_page(request, message_id)
-    except ValueError as e:
-        logging.error(e)
-        raise web.HTTPNotFound
-
-async def serve_player_page(request, message_id):
-    try:
-        # Get file properties
-        file_properties = await streamer.get_file_properties(message_id)
-        file_name = file_properties.get("file_name", "Unknown")
-        mime_type = file_properties.get("mime_type", "application/octet-stream")
-        media_type = file_properties.get("media_type", "document")
-        
-        # Generate stream URL
-        stream_url = f"{request.url.scheme}://{request.url.host}"
-        if request.url.port and request.url.port != 80 and request.url.port != 443:
-            stream_url += f":{request.url.port}"
-        stream_url += f"/{message_id}/{urllib.parse.quote(file_name)}"
-        
-        # Generate download URL
-        download_url = f"{stream_url}?download=1"
-        
-        # Determine if media is streamable
-        is_video = media_type == "video" or mime_type.startswith("video/")
-        is_audio = media_type == "audio" or mime_type.startswith("audio/")
-        
-        # Generate HTML for player
-        player_html = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>{file_name} - Stream Player</title>
-            <style>
-                body {{
-                    font-family: Arial, sans-serif;
-                    background-color: #f0f0f0;
-                    margin: 0;
-                    padding: 0;
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                    min-height: 100vh;
-                }}
-                .container {{
-                    background-color: white;
-                    border-radius: 8px;
-                    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-                    overflow: hidden;
-                    width: 90%;
-                    max-width: 800px;
-                }}
-                .title {{
-                    background-color: #2196F3;
-                    color: white;
-                    padding: 15px;
-                    text-align: center;
-                    font-size: 18px;
-                    margin: 0;
-                    word-break: break-all;
-                }}
-                .player-wrapper {{
-                    padding: 20px;
-                }}
-                .video-player {{
-                    width: 100%;
-                    max-height: 500px;
-                    background-color: #000;
-                }}
-                .audio-player {{
-                    width: 100%;
-                    margin: 20px 0;
-                }}
-                .download-btn {{
-                    display: block;
-                    text-align: center;
-                    background-color: #4CAF50;
-                    color: white;
-                    padding: 10px;
-                    text-decoration: none;
-                    border-radius: 4px;
-                    margin: 20px auto;
-                    width: 200px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h2 class="title">{file_name}</h2>
-                <div class="player-wrapper">
-        """
-        
-        if is_video:
-            player_html += f"""
-                    <video class="video-player" controls autoplay>
-                        <source src="{stream_url}" type="{mime_type}">
-                        Your browser does not support the video tag.
-                    </video>
-            """
-        elif is_audio:
-            player_html += f"""
-                    <audio class="audio-player" controls autoplay>
-                        <source src="{stream_url}" type="{mime_type}">
-                        Your browser does not support the audio tag.
-                    </audio>
-            """
-        else:
-            player_html += f"""
-                    <p>This file type ({mime_type}) is not supported for streaming playback.</p>
-            """
-        
-        player_html += f"""
-                </div>
-                <a href="{download_url}" class="download-btn">Download File</a>
-            </div>
-        </body>
-        </html>
-        """
-        
-        return web.Response(text=player_html, content_type='text/html')
-    except Exception as e:
-        logging.error(f"Error in player page: {e}")
-        raise web.HTTPNotFound
+def finish_background_task(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning(f"Background task failed: {task.exception()}")
 
 async def media_streamer(request, message_id, file_name=None):
     try:
         range_header = request.headers.get('Range', 0)
         is_download = 'download' in request.query and request.query['download'] == '1'
         
+        # Pick the least busy client, file ids are resolved per client
+        tg_connect = select_streamer()
+        
         # Get file properties
-        file_properties = await streamer.get_file_properties(message_id)
+        file_properties = await tg_connect.get_file_properties(message_id)
         if not file_name:
             file_name = file_properties.get("file_name", f"file_{message_id}")
         mime_type = file_properties.get("mime_type", "application/octet-stream")
         file_size = file_properties.get("file_size", 0)
         
-        if range_header:
-            from_bytes, until_bytes = range_header.replace('bytes=', '').split('-')
-            from_bytes = int(from_bytes)
-            until_bytes = int(until_bytes) if until_bytes else file_size - 1
-        else:
-            from_bytes = 0
-            until_bytes = file_size - 1
-
-        # Calculate chunk size
-        chunk_size = 1024 * 1024  # 1MB chunk
-        total_size = until_bytes - from_bytes + 1
-        
-        part_count = math.ceil(total_size / chunk_size)
-        last_part_cut = total_size % chunk_size
-        
-        if last_part_cut == 0:
-            last_part_cut = chunk_size
-        
+        etag = get_etag(file_properties)
+        last_modified = file_properties.get("date")
         headers = {
             'Content-Type': mime_type,
             'Accept-Ranges': 'bytes',
-            'Content-Range': f'bytes {from_bytes}-{until_bytes}/{file_size}',
-            'Content-Length': str(total_size),
+            # Content of a message never changes, let browsers and intermediaries cache every media type
+            'Cache-Control': 'public, max-age=604800',  # 1 week
+            'ETag': f'"{etag}"',
         }
+        if last_modified:
+            headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+        
+        # Revalidations are answered from the cached metadata
+        if is_not_modified(request, etag, last_modified):
+            return web.Response(status=304, headers={
+                name: headers[name] for name in ('Cache-Control', 'ETag', 'Last-Modified') if name in headers
+            })
+        if range_header and not if_range_matches(request, etag, last_modified):
+            range_header = None
+        
+        try:
+            ranges = parse_range(range_header, file_size) if range_header else None
+        except RangeNotSatisfiable:
+            raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{file_size}'})
+        
+        # A player starting a video will ask for the moov/Cues next, get it ready in parallel with the head
+        if request.method != 'HEAD' and (ranges is None or ranges[0][0] == 0) and container_format(mime_type):
+            task = asyncio.ensure_future(tg_connect.warm_container_index(message_id))
+            background_tasks.add(task)
+            task.add_done_callback(finish_background_task)
         
         # Set appropriate Content-Disposition header
         if is_download:
@@ -245,27 +424,99 @@ async def media_streamer(request, message_id, file_name=None):
         else:
             headers['Content-Disposition'] = f'inline; filename="{file_name}"'
         
-        # For video streaming, add more headers
-        if mime_type.startswith('video/'):
-            headers.update({
-                'Accept-Ranges': 'bytes',
-                'Cache-Control': 'max-age=604800'  # 1 week
-            })
+        # Fully cached single ranges are sent from the cache file with sendfile.
+        # FileResponse evaluates Range itself but uses the cache file's validators,
+        # so requests with If-Range, If-Match or If-Unmodified-Since are streamed
+        # instead, as are Range headers parse_range ignored
+        media_id = file_properties["file_id"].media_id
+        from_bytes, until_bytes = ranges[0] if ranges else (0, file_size - 1)
+        single_range = len(ranges) == 1 if ranges else not range_header
+        if file_size and single_range and request.method != 'HEAD' and \
+                not any(name in request.headers for name in ('If-Range', 'If-Match', 'If-Unmodified-Since')) and \
+                tg_connect.disk_cache.has_range(media_id, from_bytes, until_bytes):
+            tg_connect.disk_cache.record_served(until_bytes - from_bytes + 1)
+            BYTES_SERVED.inc("sendfile", amount=until_bytes - from_bytes + 1)
+            return CachedFileResponse(tg_connect.disk_cache.data_path(media_id), headers=headers)
+        
+        status = 206
+        if ranges is None:
+            status = 200
+            ranges = [(0, file_size - 1)] if file_size else []
+            headers['Content-Length'] = str(file_size)
+        elif len(ranges) == 1:
+            headers['Content-Range'] = f'bytes {from_bytes}-{until_bytes}/{file_size}'
+            headers['Content-Length'] = str(until_bytes - from_bytes + 1)
+        
+        # Each range is preceded by its part header in a multipart/byteranges body
+        multipart = len(ranges) > 1
+        part_headers = [b""] * len(ranges)
+        if multipart:
+            boundary = secrets.token_hex(16)
+            part_headers = [
+                f'\r\n--{boundary}\r\nContent-Type: {mime_type}\r\n'
+                f'Content-Range: bytes {start}-{until}/{file_size}\r\n\r\n'.encode()
+                for start, until in ranges
+            ]
+            closing = f'\r\n--{boundary}--\r\n'.encode()
+            headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+            headers['Content-Length'] = str(
+                sum(len(h) for h in part_headers) + sum(until - start + 1 for start, until in ranges) + len(closing)
+            )
         
-        response = web.StreamResponse(status=206 if range_header else 200, headers=headers)
+        # HEAD only needs the headers, no Telegram session is touched
+        if request.method == 'HEAD':
+            return web.Response(status=status, headers=headers)
+        
+        dc_id = file_properties["file_id"].dc_id
+        if not tg_connect.dc_available(dc_id):
+            # Fail fast instead of starting a response that can't be completed
+            raise web.HTTPServiceUnavailable(
+                text=f"DC {dc_id} is temporarily unavailable", headers={'Retry-After': str(Var.BREAKER_COOLDOWN)}
+            )
+        
+        response = web.StreamResponse(status=status, headers=headers)
         await response.prepare(request)
         
-        for chunk_index in range(part_count):
-            offset = from_bytes + (chunk_index * chunk_size)
-            first_part_cut = min(chunk_size, total_size - (chunk_index * chunk_size))
-            
-            if chunk_index == 0:
-                first_part_cut = chunk_size - from_bytes % chunk_size
-            
-            chunk = await streamer.yield_file(message_id, offset, first_part_cut, last_part_cut, part_count, chunk_size)
-            await response.write(chunk)
+        # Fair share of GetFile slots per client IP, playback ahead of bulk downloads
+        flow = scheduler.open_flow(request.remote, DOWNLOAD if is_download else PLAYBACK)
+        tg_connect.active_streams += 1
+        ACTIVE_STREAMS.inc(dc_id)
+        try:
+            for part_header, (start, until) in zip(part_headers, ranges):
+                if part_header:
+                    await response.write(part_header)
+                if chunk_origin is not None:
+                    # Edge mode, built from the immutable chunk URLs so a CDN can absorb repeat traffic
+                    chunks = chunk_origin.stream_range(message_id, file_size, start, until)
+                else:
+                    # Fetch the aligned parts ahead of the writer so Telegram and client round-trips overlap
+                    chunks = tg_connect.prefetch_file(message_id, tg_connect.plan_file(file_properties, start, until),
+                                                      flow=flow)
+                try:
+                    async for chunk in chunks:
+                        await response.write(chunk)
+                        BYTES_SERVED.inc("stream", amount=len(chunk))
+                finally:
+                    await chunks.aclose()
+            if multipart:
+                await response.write(closing)
+        except ChunkFetchError as e:
+            # The headers are already sent, cut the connection so the client sees a
+            # truncated body instead of a complete looking but corrupted file
+            logging.warning(f"Aborting stream of {message_id}: {e}")
+            response.force_close()
+            if request.transport is not None:
+                request.transport.close()
+        finally:
+            tg_connect.active_streams -= 1
+            ACTIVE_STREAMS.dec(dc_id)
+            scheduler.close_flow(flow)
         
         return response
+    except web.HTTPException:
+        raise
+    except FileNotFound:
+        raise web.HTTPNotFound
     except Exception as e:
         logging.error(f"Error in media_streamer: {str(e)}")
         raise web.HTTPInternalServerError(text=f"Error: {str(e)}")
@@ -1,22 +1,191 @@
 # (c) @AbirHasan2005
 
+import os
+import time
 import asyncio
+import logging
+import datetime
 import traceback
+import aiofiles
+from typing import Dict, List, Optional
+from pyrogram import Client
 from pyrogram.errors import FloodWait, InputUserDeactivated, UserIsBlocked, PeerIdInvalid
+from WebStreamer.vars import Var
+from WebStreamer.utils.rate_limiter import TokenBucket
+from WebStreamer.utils.retry import flood_wait_seconds
 
 
-async def send_msg(user_id, message):
+async def send_msg(user_id, message, bucket: Optional[TokenBucket] = None):
+    while True:
+        if bucket is not None:
+            await bucket.acquire()
+        try:
+            await message.forward(chat_id=user_id)
+            return 200, None
+        except FloodWait as e:
+            wait = flood_wait_seconds(e)
+            if bucket is not None:
+                # Every sender backs off, not only the one that hit the limit
+                bucket.pause(wait)
+            else:
+                await asyncio.sleep(wait)
+        except InputUserDeactivated:
+            return 400, f"{user_id} : deactivated\n"
+        except UserIsBlocked:
+            return 400, f"{user_id} : blocked the bot\n"
+        except PeerIdInvalid:
+            return 400, f"{user_id} : user id invalid\n"
+        except Exception as e:
+            return 500, f"{user_id} : {traceback.format_exc()}\n"
+
+
+def message_id_of(message) -> int:
+    # message_id in Pyrogram 1.x, id in 2.x
+    return getattr(message, "message_id", None) or message.id
+
+
+class Broadcast:
+    """
+    Forwards a message to every user.
+
+    Users are read in batches in `_id` order and each batch is sent by up to
+    `concurrency` tasks sharing one token bucket, so the global send rate stays
+    under Telegram's limits and a FloodWait pauses all of them. After a batch
+    its dead users are deleted with a single query and the position is saved
+    to Mongo, an interrupted broadcast resumes from there and resends at most
+    one batch.
+    """
+
+    def __init__(self, client: Client, db, doc: Dict):
+        self.client = client
+        self.db = db
+        self.id = doc["_id"]
+        self.chat_id = doc["chat_id"]
+        self.message_id = doc["message_id"]
+        self.reply_to = doc.get("reply_to")
+        self.total = doc.get("total", 0)
+        self.last_id = doc.get("last_id")
+        self.done = doc.get("done", 0)
+        self.success = doc.get("success", 0)
+        self.failed = doc.get("failed", 0)
+        self.started_at = doc.get("started_at", time.time())
+        self.cancelled = False
+        self.bucket = TokenBucket(Var.BROADCAST_RATE, capacity=Var.BROADCAST_RATE)
+        self.concurrency = max(1, Var.BROADCAST_CONCURRENCY)
+        self.batch_size = max(self.concurrency, Var.BROADCAST_BATCH_SIZE)
+
+    @property
+    def log_path(self) -> str:
+        return f"broadcast_{self.id}.txt"
+
+    def checkpoint(self) -> Dict:
+        return dict(
+            chat_id=self.chat_id,
+            message_id=self.message_id,
+            reply_to=self.reply_to,
+            total=self.total,
+            last_id=self.last_id,
+            done=self.done,
+            success=self.success,
+            failed=self.failed,
+            started_at=self.started_at
+        )
+
+    def progress(self) -> str:
+        elapsed = max(time.time() - self.started_at, 1)
+        rate = self.done / elapsed
+        remaining = datetime.timedelta(seconds=int((self.total - self.done) / rate)) if rate else "unknown"
+        return (f"`{self.id}`: {self.done}/{self.total} done, {self.success} success and {self.failed} failed, "
+                f"{rate:.1f} users/s, about {remaining} left")
+
+    async def _send_batch(self, users: List[Dict], log_file) -> List[int]:
+        queue = asyncio.Queue()
+        for user in users:
+            queue.put_nowait(int(user["id"]))
+        dead = []
+
+        async def worker():
+            while not queue.empty() and not self.cancelled:
+                user_id = queue.get_nowait()
+                sts, msg = await send_msg(user_id, self.message, self.bucket)
+                if msg is not None:
+                    await log_file.write(msg)
+                if sts == 200:
+                    self.success += 1
+                else:
+                    self.failed += 1
+                if sts == 400:
+                    dead.append(user_id)
+                self.done += 1
+
+        await asyncio.gather(*[worker() for _ in range(min(self.concurrency, len(users)))])
+        return dead
+
+    async def run(self):
+        self.message = await self.client.get_messages(self.chat_id, self.message_id)
+        async with aiofiles.open(self.log_path, "a") as log_file:
+            while not self.cancelled:
+                users = await self.db.get_users_after(self.last_id, self.batch_size)
+                if not users:
+                    break
+                dead = await self._send_batch(users, log_file)
+                if dead:
+                    await self.db.delete_users(dead)
+                if self.cancelled:
+                    break
+                self.last_id = users[-1]["_id"]
+                await self.db.save_broadcast(self.id, self.checkpoint())
+                await log_file.flush()
+        await self.db.finish_broadcast(self.id)
+        await self.report()
+
+    async def report(self):
+        completed_in = datetime.timedelta(seconds=int(time.time() - self.started_at))
+        state = "cancelled" if self.cancelled else "completed"
+        text = (f"broadcast {state} in `{completed_in}`\n\nTotal users {self.total}.\n"
+                f"Total done {self.done}, {self.success} success and {self.failed} failed.")
+        if self.failed == 0:
+            await self.client.send_message(self.chat_id, text, reply_to_message_id=self.reply_to)
+        else:
+            await self.client.send_document(self.chat_id, self.log_path, caption=text,
+                                            reply_to_message_id=self.reply_to)
+        os.remove(self.log_path)
+
+
+# Running broadcasts by id, for /broadcast_status and /broadcast_cancel
+running_broadcasts: Dict[str, Broadcast] = {}
+# Tasks of the running broadcasts, the event loop only keeps weak references to them
+broadcast_tasks = set()
+
+
+async def run_broadcast(broadcast: Broadcast):
+    running_broadcasts[broadcast.id] = broadcast
     try:
-        await message.forward(chat_id=user_id)
-        return 200, None
-    except FloodWait as e:
-        await asyncio.sleep(e.x)
-        return send_msg(user_id, message)
-    except InputUserDeactivated:
-        return 400, f"{user_id} : deactivated\n"
-    except UserIsBlocked:
-        return 400, f"{user_id} : blocked the bot\n"
-    except PeerIdInvalid:
-        return 400, f"{user_id} : user id invalid\n"
-    except Exception as e:
-        return 500, f"{user_id} : {traceback.format_exc()}\n"
\ No newline at end of file
+        await broadcast.run()
+    except Exception:
+        logging.exception(f"Broadcast {broadcast.id} stopped, it will resume on the next start")
+    finally:
+        running_broadcasts.pop(broadcast.id, None)
+
+
+def finish_broadcast_task(task: asyncio.Task):
+    broadcast_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Broadcast task failed: {task.exception()!r}")
+
+
+def start_broadcast(broadcast: Broadcast) -> asyncio.Task:
+    """Runs a broadcast in the background, keeping its task referenced until it finishes."""
+    task = asyncio.create_task(run_broadcast(broadcast))
+    broadcast_tasks.add(task)
+    task.add_done_callback(finish_broadcast_task)
+    return task
+
+
+async def resume_broadcasts(client: Client, db):
+    """Restarts the broadcasts interrupted by a restart from their last checkpoint."""
+    for doc in await db.get_unfinished_broadcasts():
+        if doc["_id"] in running_broadcasts:
+            continue
+        logging.info(f"Resuming broadcast {doc['_id']} after {doc.get('done', 0)} users")
+        start_broadcast(Broadcast(client, db, doc))
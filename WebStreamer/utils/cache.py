@@ -0,0 +1,121 @@
+# This file is a part of TG-FileStreamBot
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Union
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with per-entry TTL.
+
+    Entries older than their TTL but younger than TTL + `stale_ttl` are still
+    served by `get_or_load`, which refreshes them in the background
+    (stale-while-revalidate). Concurrent loads of the same key share one call.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float = 0):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self._lookup(key)[0] is not None
+
+    def _lookup(self, key):
+        """Returns (value, is_stale), or (None, False) when missing or expired."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None, False
+        value, expires_at = entry
+        now = time.monotonic()
+        if now < expires_at:
+            return value, False
+        if now < expires_at + self.stale_ttl:
+            return value, True
+        del self._data[key]
+        return None, False
+
+    def get(self, key, default=None):
+        value, stale = self._lookup(key)
+        if value is None or stale:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_load(self, key, loader: Callable[[], Awaitable[Any]],
+                          ttl: Union[float, Callable[[Any], float], None] = None):
+        """
+        Returns the cached value for `key`, calling `loader` on a miss. `ttl` may be
+        a function of the loaded value.
+        """
+        value, stale = self._lookup(key)
+        if value is not None:
+            self._data.move_to_end(key)
+            if stale:
+                self.stale_hits += 1
+                if key not in self._loading:
+                    self._start_load(key, loader, ttl).add_done_callback(self._log_refresh_error)
+            else:
+                self.hits += 1
+            return value
+        self.misses += 1
+        future = self._loading.get(key) or self._start_load(key, loader, ttl)
+        return await asyncio.shield(future)
+
+    def _start_load(self, key, loader, ttl) -> asyncio.Future:
+        async def load():
+            try:
+                value = await loader()
+                if value is not None:
+                    self.set(key, value, ttl(value) if callable(ttl) else ttl)
+                return value
+            finally:
+                self._loading.pop(key, None)
+
+        future = asyncio.ensure_future(load())
+        self._loading[key] = future
+        return future
+
+    @staticmethod
+    def _log_refresh_error(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning(f"Background cache refresh failed: {future.exception()}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
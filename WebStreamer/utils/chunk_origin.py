@@ -0,0 +1,85 @@
+# This file is a part of TG-FileStreamBot
+
+import asyncio
+import aiohttp
+from collections import deque
+from typing import AsyncGenerator, Optional
+from WebStreamer.vars import Var
+from WebStreamer.utils.exceptions import ChunkFetchError
+
+# Size of the chunks served by /c/{message_id}/{chunk_index}
+CHUNK_SIZE = 1024 * 1024
+
+
+def chunk_length(file_size: int, index: int) -> int:
+    return max(0, min(CHUNK_SIZE, file_size - index * CHUNK_SIZE))
+
+
+class ChunkOrigin:
+    """
+    Reads media through the immutable chunk URLs of `base_url`.
+
+    With CHUNK_ORIGIN_URL pointing at a CDN or caching proxy in front of the
+    /c/ route, ranges are assembled from whole chunks the edge cache can keep,
+    so repeat traffic never reaches Telegram.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 60):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        return self._session
+
+    async def fetch_chunk(self, message_id: int, index: int, length: int) -> bytes:
+        url = f"{self.base_url}/c/{message_id}/{index}"
+        try:
+            async with self.session.get(url) as response:
+                if response.status != 200:
+                    raise ChunkFetchError(f"{url} answered {response.status}")
+                data = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ChunkFetchError(f"Couldn't fetch {url}: {e}") from e
+        if len(data) != length:
+            raise ChunkFetchError(f"{url} returned {len(data)} bytes instead of {length}")
+        return data
+
+    async def stream_range(self, message_id: int, file_size: int, from_bytes: int, until_bytes: int,
+                           window: int = Var.PREFETCH_CHUNKS) -> AsyncGenerator[memoryview, None]:
+        """Yields [from_bytes, until_bytes] chunk by chunk, keeping `window` chunk requests in flight."""
+        first, last = from_bytes // CHUNK_SIZE, until_bytes // CHUNK_SIZE
+        indexes = iter(range(first, last + 1))
+        pending = deque()
+
+        def schedule():
+            for index in indexes:
+                pending.append((index, asyncio.ensure_future(
+                    self.fetch_chunk(message_id, index, chunk_length(file_size, index))
+                )))
+                return
+
+        try:
+            for _ in range(max(1, window)):
+                schedule()
+            while pending:
+                index, task = pending.popleft()
+                data = memoryview(await task)
+                schedule()
+                block = index * CHUNK_SIZE
+                yield data[max(from_bytes, block) - block:min(until_bytes, block + CHUNK_SIZE - 1) - block + 1]
+        finally:
+            for _, task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+chunk_origin = ChunkOrigin(Var.CHUNK_ORIGIN_URL) if Var.CHUNK_ORIGIN_URL else None
@@ -0,0 +1,348 @@
+# This file is a part of TG-FileStreamBot
+
+import struct
+import asyncio
+from bisect import bisect_right
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Reads `length` bytes at `offset` of the file
+Reader = Callable[[int, int], Awaitable[bytes]]
+
+# Indexes bigger than this aren't worth a probe
+MAX_INDEX_SIZE = 32 * 1024 * 1024
+# Keyframes kept per file, evenly thinned beyond that
+MAX_KEYFRAMES = 4096
+MKV_HEAD_SIZE = 64 * 1024
+# Indexes up to this size are parsed inline, bigger ones in a thread
+INLINE_PARSE_SIZE = 256 * 1024
+
+MP4_TYPES = ("video/mp4", "video/quicktime", "video/x-m4v", "audio/mp4", "audio/x-m4a")
+MKV_TYPES = ("video/x-matroska", "video/webm", "audio/webm", "audio/x-matroska")
+
+
+class ContainerError(Exception):
+    """Raised when a container can't be parsed."""
+
+
+async def parse(parser: Callable, data: bytes, *args):
+    """Runs a parser, off the event loop for big indexes so streams don't stall while it runs."""
+    if len(data) <= INLINE_PARSE_SIZE:
+        return parser(data, *args)
+    return await asyncio.get_running_loop().run_in_executor(None, parser, data, *args)
+
+
+def container_format(mime_type: str) -> Optional[str]:
+    if mime_type in MP4_TYPES:
+        return "mp4"
+    if mime_type in MKV_TYPES:
+        return "mkv"
+    return None
+
+
+def thin(keyframes: List[Tuple[float, int]], limit: int = MAX_KEYFRAMES) -> List[Tuple[float, int]]:
+    if len(keyframes) <= limit:
+        return keyframes
+    step = len(keyframes) / limit
+    return [keyframes[int(i * step)] for i in range(limit)]
+
+
+def seek(index: Dict, seconds: float) -> Optional[Tuple[float, int]]:
+    """Returns the last keyframe at or before `seconds` as (time, byte offset)."""
+    keyframes = index.get("keyframes") if index else None
+    if not keyframes:
+        return None
+    position = bisect_right([time for time, _ in keyframes], seconds) - 1
+    time, offset = keyframes[max(0, position)]
+    return time, offset
+
+
+# MP4 / ISO BMFF
+
+def iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """Yields (type, payload start, box end) of the boxes in data[start:end]."""
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, position)
+        header = 8
+        if size == 1:
+            if position + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, position + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            return
+        yield box_type, position + header, min(position + size, end)
+        position += size
+
+
+def find_box(data: bytes, path: List[bytes], start: int = 0, end: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    for box_type, payload, box_end in iter_boxes(data, start, end):
+        if box_type == path[0]:
+            return (payload, box_end) if len(path) == 1 else find_box(data, path[1:], payload, box_end)
+    return None
+
+
+def _full_box_entries(data: bytes, box: Tuple[int, int], header: int = 8) -> Tuple[int, int]:
+    """Returns (entry count, first entry offset) of a full box with a count after `header` bytes."""
+    payload, _ = box
+    return struct.unpack_from(">I", data, payload + header - 4)[0], payload + header
+
+
+def _media_header(data: bytes, box: Tuple[int, int]) -> Tuple[int, int]:
+    """Returns (timescale, duration) of a mvhd or mdhd box."""
+    payload, _ = box
+    if data[payload] == 1:
+        return struct.unpack_from(">IQ", data, payload + 20)
+    return struct.unpack_from(">II", data, payload + 12)
+
+
+def parse_moov(data: bytes) -> Dict:
+    """Builds the keyframe index of a moov box payload."""
+    mvhd = find_box(data, [b"mvhd"])
+    if mvhd is None:
+        raise ContainerError("moov without mvhd")
+    timescale, duration = _media_header(data, mvhd)
+    index = {"duration": duration / timescale if timescale else 0.0, "keyframes": []}
+
+    tracks = [(payload, box_end) for box_type, payload, box_end in iter_boxes(data) if box_type == b"trak"]
+    track = None
+    for payload, box_end in tracks:
+        hdlr = find_box(data, [b"mdia", b"hdlr"], payload, box_end)
+        if hdlr is not None and data[hdlr[0] + 8:hdlr[0] + 12] == b"vide":
+            track = (payload, box_end)
+            break
+    if track is None:
+        if not tracks:
+            return index
+        track = tracks[0]
+
+    mdhd = find_box(data, [b"mdia", b"mdhd"], *track)
+    stbl = find_box(data, [b"mdia", b"minf", b"stbl"], *track)
+    if mdhd is None or stbl is None:
+        return index
+    track_timescale = _media_header(data, mdhd)[0] or 1
+    boxes = {box_type: (payload, box_end) for box_type, payload, box_end in iter_boxes(data, *stbl)}
+    if b"stts" not in boxes or b"stsc" not in boxes or b"stsz" not in boxes or \
+            (b"stco" not in boxes and b"co64" not in boxes):
+        return index
+
+    # Decode time of every sample
+    count, position = _full_box_entries(data, boxes[b"stts"])
+    times = []
+    time = 0
+    for i in range(count):
+        sample_count, delta = struct.unpack_from(">II", data, position + i * 8)
+        for _ in range(sample_count):
+            times.append(time)
+            time += delta
+
+    # Size of every sample
+    payload, _ = boxes[b"stsz"]
+    sample_size, sample_count = struct.unpack_from(">II", data, payload + 4)
+    if sample_size:
+        sizes = [sample_size] * sample_count
+    else:
+        sizes = list(struct.unpack_from(f">{sample_count}I", data, payload + 12))
+
+    # Offset of every chunk
+    if b"co64" in boxes:
+        count, position = _full_box_entries(data, boxes[b"co64"])
+        chunk_offsets = struct.unpack_from(f">{count}Q", data, position)
+    else:
+        count, position = _full_box_entries(data, boxes[b"stco"])
+        chunk_offsets = struct.unpack_from(f">{count}I", data, position)
+
+    # Offset of every sample, from the sample to chunk table
+    count, position = _full_box_entries(data, boxes[b"stsc"])
+    stsc = [struct.unpack_from(">III", data, position + i * 12)[:2] for i in range(count)]
+    offsets = []
+    sample = 0
+    for i, (first_chunk, samples_per_chunk) in enumerate(stsc):
+        last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunk_offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            offset = chunk_offsets[chunk]
+            for _ in range(samples_per_chunk):
+                if sample >= len(sizes):
+                    break
+                offsets.append(offset)
+                offset += sizes[sample]
+                sample += 1
+
+    if b"stss" in boxes:
+        count, position = _full_box_entries(data, boxes[b"stss"])
+        sync_samples = [number - 1 for number in struct.unpack_from(f">{count}I", data, position)]
+    else:
+        sync_samples = range(len(offsets))
+    index["keyframes"] = thin([
+        (round(times[number] / track_timescale, 3), offsets[number])
+        for number in sync_samples if number < len(offsets) and number < len(times)
+    ])
+    return index
+
+
+async def probe_mp4(read: Reader, file_size: int) -> Optional[Dict]:
+    """Walks the top level boxes to the moov box, wherever it is, and indexes it."""
+    offset = 0
+    while offset + 8 <= file_size:
+        header = await read(offset, min(16, file_size - offset))
+        size, box_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            raise ContainerError(f"Invalid box size {size} at {offset}")
+        if box_type == b"moov":
+            if size > MAX_INDEX_SIZE:
+                return None
+            index = await parse(parse_moov, await read(offset + header_size, size - header_size))
+            index.update(format="mp4", index_offset=offset, index_size=size)
+            return index
+        offset += size
+    return None
+
+
+# Matroska / WebM
+
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_CLUSTER_POSITION = 0xF1
+
+
+def read_vint(data: bytes, position: int, keep_marker: bool = False) -> Tuple[int, int]:
+    """Returns (value, length) of the EBML variable size integer at `position`."""
+    first = data[position]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8 or position + length > len(data):
+        raise ContainerError(f"Invalid EBML integer at {position}")
+    value = first if keep_marker else first & (0xFF >> length)
+    for i in range(1, length):
+        value = (value << 8) | data[position + i]
+    return value, length
+
+
+def iter_elements(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int, int]]:
+    """Yields (id, payload start, payload end) of the EBML elements in data[start:end]."""
+    end = len(data) if end is None else end
+    position = start
+    while position < end:
+        element_id, id_length = read_vint(data, position, keep_marker=True)
+        size, size_length = read_vint(data, position + id_length)
+        payload = position + id_length + size_length
+        if size == (1 << (7 * size_length)) - 1:
+            # Unknown size, only happens for Segment and Cluster
+            size = end - payload
+        yield element_id, payload, min(payload + size, end)
+        position = payload + size
+
+
+def _uint(data: bytes, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], "big")
+
+
+def parse_cues(data: bytes, segment_start: int, timecode_scale: int) -> List[Tuple[float, int]]:
+    keyframes = []
+    for element_id, payload, end in iter_elements(data):
+        if element_id != CUE_POINT:
+            continue
+        time = position = None
+        for child_id, child, child_end in iter_elements(data, payload, end):
+            if child_id == CUE_TIME:
+                time = _uint(data, child, child_end)
+            elif child_id == CUE_TRACK_POSITIONS and position is None:
+                for grandchild_id, grandchild, grandchild_end in iter_elements(data, child, child_end):
+                    if grandchild_id == CUE_CLUSTER_POSITION:
+                        position = _uint(data, grandchild, grandchild_end)
+        if time is not None and position is not None:
+            keyframes.append((round(time * timecode_scale / 1e9, 3), segment_start + position))
+    return thin(keyframes)
+
+
+async def probe_mkv(read: Reader, file_size: int) -> Optional[Dict]:
+    """Finds the Cues through the SeekHead at the start of the Segment and indexes them."""
+    head = await read(0, min(MKV_HEAD_SIZE, file_size))
+    segment_start = None
+    for element_id, payload, _ in iter_elements(head):
+        if element_id == SEGMENT:
+            segment_start = payload
+            break
+    if segment_start is None:
+        raise ContainerError("No Segment in the file head")
+
+    cues_position = None
+    timecode_scale = 1000000
+    duration = 0.0
+    try:
+        for element_id, payload, end in iter_elements(head, segment_start):
+            if element_id == SEEK_HEAD:
+                for seek_id, seek, seek_end in iter_elements(head, payload, end):
+                    if seek_id != SEEK:
+                        continue
+                    target = position = None
+                    for child_id, child, child_end in iter_elements(head, seek, seek_end):
+                        if child_id == SEEK_ID:
+                            target = _uint(head, child, child_end)
+                        elif child_id == SEEK_POSITION:
+                            position = _uint(head, child, child_end)
+                    if target == CUES and position is not None:
+                        cues_position = segment_start + position
+            elif element_id == INFO:
+                for child_id, child, child_end in iter_elements(head, payload, end):
+                    if child_id == TIMECODE_SCALE:
+                        timecode_scale = _uint(head, child, child_end)
+                    elif child_id == DURATION:
+                        duration = struct.unpack(">f" if child_end - child == 4 else ">d", head[child:child_end])[0]
+            elif element_id == 0x1F43B675:
+                # First Cluster, the metadata is before it
+                break
+    except (ContainerError, IndexError, struct.error):
+        # Elements cut by the end of the head
+        pass
+    if cues_position is None or cues_position >= file_size:
+        return None
+
+    header = await read(cues_position, min(16, file_size - cues_position))
+    element_id, id_length = read_vint(header, 0, keep_marker=True)
+    size, size_length = read_vint(header, id_length)
+    if element_id != CUES or size > MAX_INDEX_SIZE:
+        return None
+    payload = cues_position + id_length + size_length
+    cues = await read(payload, min(size, file_size - payload))
+    keyframes = await parse(parse_cues, cues, segment_start, timecode_scale)
+    return {
+        "format": "mkv",
+        "duration": round(duration * timecode_scale / 1e9, 3),
+        "index_offset": cues_position,
+        "index_size": id_length + size_length + size,
+        "keyframes": keyframes,
+    }
+
+
+async def probe(read: Reader, file_size: int, mime_type: str) -> Optional[Dict]:
+    """Returns the seek index of a MP4 or Matroska file, None for other files or when there is none."""
+    container = container_format(mime_type)
+    try:
+        if container == "mp4":
+            return await probe_mp4(read, file_size)
+        if container == "mkv":
+            return await probe_mkv(read, file_size)
+    except (ContainerError, IndexError, struct.error) as e:
+        raise ContainerError(f"Couldn't index the {container} container: {e}") from e
+    return None
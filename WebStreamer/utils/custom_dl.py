@@ -1,162 +1,543 @@
 # (c) @AbirHasan2005
 
 import os
+import time
+import datetime
 import asyncio
 import logging
 import threading
-from typing import Dict, Union
+from collections import deque
+from typing import AsyncGenerator, Callable, Dict, Iterable, List, Optional, Tuple, Union
 from WebStreamer.vars import Var
 from pyrogram.types import Message
 from pyrogram import Client, utils, raw
-from pyrogram.errors import FloodWait, MessageNotModified
-from pyrogram.session import Session, Auth
+from pyrogram.errors import FloodWait, FileReferenceExpired, FileReferenceInvalid, MessageNotModified
+from pymongo.errors import PyMongoError
 from pyrogram.file_id import FileId, FileType, ThumbnailSource
+from WebStreamer.utils.cache import TTLCache
+from WebStreamer.utils import container_index
+from WebStreamer.utils.container_index import ContainerError
+from WebStreamer.utils.database import Database, db
+from WebStreamer.utils.disk_cache import ChunkDiskCache, chunk_cache
+from WebStreamer.utils.media_session import MediaSessionPool
+from WebStreamer.utils.single_flight import SingleFlight
+from WebStreamer.utils.thumbnail_cache import ThumbnailCache, thumbnail_cache
+from WebStreamer.utils.range_planner import ChunkSizer, Part, plan_parts
+from WebStreamer.utils.scheduler import FairScheduler, Flow, scheduler
+from WebStreamer.utils.exceptions import ChunkFetchError, FileNotFound
+from WebStreamer.utils.metrics import (
+    COLLECTORS, Counter, Gauge, METADATA_SECONDS, SESSION_ACQUIRE_SECONDS, GETFILE_SECONDS, GETFILE_OUTCOMES,
+    GETFILE_RETRIES
+)
+from WebStreamer.utils.retry import CircuitBreaker, backoff_delay, flood_wait_seconds, is_transient
+
+# In-flight chunk downloads keyed by (media_id, offset, limit), shared by every ByteStreamer
+chunk_requests = SingleFlight()
+# Largest GetFile request, a stored thumbnail always fits in one
+THUMBNAIL_LIMIT = 1024 * 1024
 
 
 class ByteStreamer:
-    def __init__(self, client: Client):
+    def __init__(self, client: Client, disk_cache: ChunkDiskCache = chunk_cache,
+                 chunk_requests: SingleFlight = chunk_requests, scheduler: FairScheduler = scheduler,
+                 file_index: Optional[Database] = db, thumbnails: ThumbnailCache = thumbnail_cache):
         self.client = client
-        self.cached_file_ids = {}
-        # Change how we handle clean_cache to avoid the "no running event loop" error
-        # Instead of using create_task here, we'll initialize it later when the bot starts
-        self._cache_cleaner = None
-
-    async def start_cache_cleaner(self):
-        """Method to start the cache cleaner task after the bot is running"""
-        self._cache_cleaner = asyncio.create_task(self.clean_cache())
+        self.file_index = file_index
+        # Message refetches after an expired file reference, keyed by message_id
+        self.refreshes = SingleFlight()
+        # Container index probes keyed by message_id
+        self.probes = SingleFlight()
+        self.thumbnails = thumbnails
+        # Thumbnail downloads keyed by unique id and size
+        self.thumbnail_requests = SingleFlight()
+        self.session_pool = MediaSessionPool(client)
+        self.disk_cache = disk_cache
+        self.chunk_requests = chunk_requests
+        self.scheduler = scheduler
+        # Per DC circuit breakers failing requests fast while a DC is unhealthy
+        self.breakers: Dict[int, CircuitBreaker] = {}
+        # Load figures used to pick the least busy client, see select_streamer
+        self.active_streams = 0
+        self.latency = 0.0
+        # Size of the first request of a stream, tuned per DC from measured RTT and throughput
+        self.chunk_sizer = ChunkSizer(default_limit=Var.FIRST_CHUNK_SIZE * 1024)
+        # Metadata of BIN_CHANNEL messages keyed by message_id, in front of the
+        # Mongo file index, so a stream makes at most one lookup instead of one per chunk
+        self.file_cache = TTLCache(
+            maxsize=Var.METADATA_CACHE_SIZE,
+            ttl=Var.METADATA_CACHE_TTL,
+            stale_ttl=Var.METADATA_CACHE_STALE_TTL
+        )
 
-    async def clean_cache(self):
-        """A task that periodically cleans the cached file IDs"""
-        while True:
-            await asyncio.sleep(600)  # Clean every 10 minutes
-            self.cached_file_ids.clear()
-            logging.info("Cleaned cached file IDs")
-
-    async def get_file_properties(self, message: Message) -> Dict[str, Union[str, int]]:
+    @staticmethod
+    def parse_file_properties(message: Message) -> Dict[str, Union[FileId, str, int]]:
         """
         Returns file properties of the given Pyrogram message.
         """
-        file_id = None
-        file_size = None
-        mime_type = None
-        file_name = None
-
-        if message.document:
-            file_id = message.document.file_id
-            file_size = message.document.file_size
-            mime_type = message.document.mime_type
-            file_name = message.document.file_name
-        elif message.video:
-            file_id = message.video.file_id
-            file_size = message.video.file_size
-            mime_type = message.video.mime_type
-            file_name = message.video.file_name
-        elif message.audio:
-            file_id = message.audio.file_id
-            file_size = message.audio.file_size
-            mime_type = message.audio.mime_type
-            file_name = message.audio.file_name
-        elif message.photo:
-            largest_photo = message.photo.sizes[-1]
-            file_id = largest_photo.file_id
-            file_size = largest_photo.file_size
+        media_type = None
+        for media_type in ("document", "video", "audio", "photo", "voice"):
+            media = getattr(message, media_type, None)
+            if media:
+                break
+        else:
+            return None
+
+        if media_type == "photo":
             mime_type = "image/jpeg"
-            file_name = f"photo_{message.photo.file_id}.jpg"
-        elif message.voice:
-            file_id = message.voice.file_id
-            file_size = message.voice.file_size
-            mime_type = message.voice.mime_type
-            file_name = f"voice_{message.voice.file_id}.{message.voice.mime_type.split('/')[-1]}"
-        # Add more file types as needed
+            file_name = f"photo_{media.file_unique_id}.jpg"
+        elif media_type == "voice":
+            mime_type = media.mime_type or "audio/ogg"
+            file_name = f"voice_{media.file_unique_id}.{mime_type.split('/')[-1]}"
+        else:
+            mime_type = media.mime_type
+            file_name = media.file_name
+
+        # The largest thumbnail Telegram keeps for the media, "" when it has none
+        thumbs = getattr(media, "thumbs", None) or []
+        thumb = max(thumbs, key=lambda t: t.width * t.height, default=None)
+
+        date = message.date
+        if isinstance(date, datetime.datetime):
+            date = date.timestamp()
 
         return {
-            "file_id": file_id,
-            "file_size": file_size,
+            "file_id": FileId.decode(media.file_id),
+            "unique_id": media.file_unique_id,
+            "date": int(date or 0),
+            "file_size": media.file_size or 0,
             "mime_type": mime_type or "application/octet-stream",
-            "file_name": file_name or f"file_{file_id}"
+            "file_name": file_name or f"file_{media.file_unique_id}",
+            "media_type": media_type,
+            "thumb_size": FileId.decode(thumb.file_id).thumbnail_size if thumb else ""
         }
 
-    async def get_location(self, file_id: str) -> str:
+    async def get_file_properties(self, message_id: int) -> Dict[str, Union[FileId, str, int]]:
         """
-        Gets the location of the given file_id.
+        Returns the cached file properties of a BIN_CHANNEL message, fetching it on a miss.
         """
-        if file_id in self.cached_file_ids:
-            return self.cached_file_ids[file_id]
+        started = time.monotonic()
+        properties = await self.file_cache.get_or_load(
+            int(message_id), lambda: self._fetch_file_properties(int(message_id))
+        )
+        METADATA_SECONDS.observe(time.monotonic() - started)
+        if properties is None:
+            raise FileNotFound(f"No media found in message: {message_id}")
+        return properties
+
+    @property
+    def bot_id(self) -> int:
+        me = getattr(self.client, "me", None)
+        return me.id if me else int(self.client.bot_token.split(":")[0])
 
+    async def _fetch_file_properties(self, message_id: int) -> Dict[str, Union[FileId, str, int]]:
+        """Reads the file index, falling back to Telegram for files it doesn't know for this bot."""
+        properties = await self._load_indexed_properties(message_id)
+        if properties is not None:
+            return properties
+        return await self._fetch_message_properties(message_id)
+
+    async def _load_indexed_properties(self, message_id: int) -> Optional[Dict[str, Union[FileId, str, int]]]:
+        if self.file_index is None:
+            return None
         try:
-            message = await self.client.get_messages(Var.BIN_CHANNEL, message_ids=int(file_id))
-            media = message.document or message.video or message.audio or message.photo or message.voice
-            if not media:
-                return None
-
-            decoded = FileId.decode(media.file_id)
-            file_reference = decoded.file_reference
-            
-            # Store in cache
-            self.cached_file_ids[file_id] = file_reference
-            return file_reference
-        except Exception as e:
-            logging.error(f"Error getting location: {str(e)}")
+            doc = await self.file_index.get_file(message_id)
+        except PyMongoError as e:
+            logging.warning(f"Couldn't read the file index: {e}")
+            return None
+        # File ids are issued per bot, another client's location is of no use
+        location = doc.get("locations", {}).get(str(self.bot_id)) if doc else None
+        if not location:
             return None
+        properties = {
+            "file_id": FileId.decode(location),
+            "unique_id": doc["unique_id"],
+            "date": doc["date"],
+            "file_size": doc["file_size"],
+            "mime_type": doc["mime_type"],
+            "file_name": doc["file_name"],
+            "media_type": doc["media_type"]
+        }
+        if "container" in doc:
+            properties["container"] = doc["container"]
+        if "thumb_size" in doc:
+            properties["thumb_size"] = doc["thumb_size"]
+        return properties
+
+    async def _fetch_message_properties(self, message_id: int) -> Dict[str, Union[FileId, str, int]]:
+        message = await self.client.get_messages(Var.BIN_CHANNEL, message_ids=message_id)
+        if not message or message.empty:
+            return None
+        properties = self.parse_file_properties(message)
+        if properties is not None:
+            await self.index_file(message_id, properties)
+        return properties
+
+    async def index_file(self, message_id: int, properties: Dict[str, Union[FileId, str, int]]):
+        """Stores the properties in the metadata cache and the file index."""
+        self.file_cache.set(int(message_id), properties)
+        if self.file_index is None:
+            return
+        try:
+            await self.file_index.save_file(message_id, self.bot_id, properties)
+        except PyMongoError as e:
+            logging.warning(f"Couldn't index file {message_id}: {e}")
+
+    async def refresh_file_properties(self, message_id: int) -> Dict[str, Union[FileId, str, int]]:
+        """Refetches the message of a file whose file reference expired."""
+        properties = await self.refreshes.do(int(message_id), lambda: self._fetch_message_properties(int(message_id)))
+        if properties is None:
+            raise FileNotFound(f"No media found in message: {message_id}")
+        return properties
 
-    async def yield_file(self, file_id: str, offset: int, first_part_cut: int,
-                         last_part_cut: int, part_count: int, chunk_size: int) -> bytes:
+    @staticmethod
+    def get_location(file_id: FileId) -> Union[raw.types.InputPhotoFileLocation,
+                                               raw.types.InputDocumentFileLocation]:
         """
-        Yield file from a specific offset with specific part cut.
+        Returns the raw file location of the given decoded file id.
         """
-        logging.info(f"Yielding file {file_id} (offset: {offset}, part_cut: {first_part_cut})")
+        if file_id.file_type == FileType.PHOTO:
+            return raw.types.InputPhotoFileLocation(
+                id=file_id.media_id,
+                access_hash=file_id.access_hash,
+                file_reference=file_id.file_reference,
+                thumb_size=file_id.thumbnail_size
+            )
+        return raw.types.InputDocumentFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=file_id.thumbnail_size
+        )
+
+    async def yield_file(self, file_id: str, offset: int, limit: int, first_part_cut: int = 0,
+                         last_part_cut: Optional[int] = None, flow: Optional[Flow] = None) -> memoryview:
+        """
+        Returns the `limit` bytes at `offset`, trimmed to [first_part_cut:last_part_cut].
+        Raises ChunkFetchError when the data couldn't be downloaded, an empty
+        chunk is never returned in place of the data.
+        """
+        logging.debug(f"Yielding file {file_id} (offset: {offset}, limit: {limit})")
         
+        properties = await self.get_file_properties(file_id)
+        file_id_obj = properties["file_id"]
+
+        # Parts inside a cached chunk are sliced out of the disk cache
+        chunk_size = self.disk_cache.chunk_size
+        block = offset - offset % chunk_size
+        cached = await self.disk_cache.read_chunk(file_id_obj.media_id, block // chunk_size)
+        if cached is not None:
+            data = memoryview(cached)[offset - block:offset - block + limit]
+        else:
+            # Concurrent viewers asking for the same chunk share a single download
+            data = memoryview(await self.chunk_requests.do(
+                (file_id_obj.media_id, offset, limit),
+                lambda: self._download_chunk(file_id, properties, offset, limit, flow)
+            ))
+        return data[first_part_cut:last_part_cut]
+
+    async def _download_chunk(self, message_id: int, properties: Dict[str, Union[FileId, str, int]], offset: int,
+                              chunk_size: int, flow: Optional[Flow] = None) -> bytes:
+        data, properties = await self._get_file(message_id, properties, lambda p: p["file_id"], offset, chunk_size,
+                                                flow)
+        # Parts are assembled into complete chunks, including the shorter last chunk of the file
+        await self.disk_cache.write_part(properties["file_id"].media_id, properties["file_size"], offset, data)
+        return data
+
+    async def _get_file(self, message_id: int, properties: Dict[str, Union[FileId, str, int]],
+                        location: Callable[[Dict], FileId], offset: int, chunk_size: int,
+                        flow: Optional[Flow] = None) -> Tuple[bytes, Dict[str, Union[FileId, str, int]]]:
+        """
+        Downloads a chunk of the file `location` picks from the properties, over a
+        pooled media session for its DC, once the scheduler gives the requesting
+        flow its turn. FloodWaits are waited out and transient errors retried with
+        backoff, outside of the scheduler slot. An expired file reference is
+        renewed once by refetching the message, the properties used are returned
+        with the data.
+        """
+        dc_id = properties["file_id"].dc_id
+        breaker = self.breakers.setdefault(dc_id, CircuitBreaker())
+        refreshed = False
+        for attempt in range(Var.CHUNK_RETRIES + 1):
+            if not breaker.allow():
+                raise ChunkFetchError(f"DC {dc_id} is unavailable")
+            try:
+                async with self.scheduler.slot(flow, chunk_size):
+                    data = await self._send_get_file(location(properties), offset, chunk_size)
+                breaker.record_success()
+                break
+            except FloodWait as e:
+                wait = flood_wait_seconds(e)
+                if wait > Var.SLEEP_THRESHOLD or attempt == Var.CHUNK_RETRIES:
+                    raise ChunkFetchError(f"FloodWait of {wait}s on DC {dc_id}") from e
+                GETFILE_RETRIES.inc(dc_id, "flood_wait")
+                await asyncio.sleep(wait)
+            except (FileReferenceExpired, FileReferenceInvalid) as e:
+                if refreshed:
+                    raise ChunkFetchError(f"File reference of {message_id} still invalid after a refetch") from e
+                refreshed = True
+                GETFILE_RETRIES.inc(dc_id, "file_reference")
+                try:
+                    properties = await self.refresh_file_properties(message_id)
+                except Exception as error:
+                    raise ChunkFetchError(f"Couldn't refetch {message_id}: {error}") from error
+            except Exception as e:
+                if not is_transient(e):
+                    raise ChunkFetchError(f"Couldn't download chunk at {offset}: {e}") from e
+                breaker.record_failure()
+                if attempt == Var.CHUNK_RETRIES:
+                    raise ChunkFetchError(f"Giving up on chunk at {offset} after {attempt + 1} attempts: {e}") from e
+                GETFILE_RETRIES.inc(dc_id, type(e).__name__)
+                await asyncio.sleep(backoff_delay(attempt))
+        else:
+            raise ChunkFetchError(f"Couldn't download chunk at {offset} of {message_id}")
+        return data, properties
+
+    async def _send_get_file(self, file_id_obj: FileId, offset: int, chunk_size: int) -> bytes:
+        dc_id = file_id_obj.dc_id
+        started = time.monotonic()
+        async with self.session_pool.acquire(dc_id) as session:
+            acquired = time.monotonic()
+            SESSION_ACQUIRE_SECONDS.observe(acquired - started, dc_id)
+            try:
+                result = await session.send(
+                    raw.functions.upload.GetFile(
+                        location=self.get_location(file_id_obj),
+                        offset=offset,
+                        limit=chunk_size  # Maximum chunk size
+                    )
+                )
+            except FloodWait:
+                GETFILE_OUTCOMES.inc(dc_id, "flood_wait")
+                raise
+            except Exception as e:
+                GETFILE_OUTCOMES.inc(dc_id, type(e).__name__)
+                raise
+        elapsed = time.monotonic() - acquired
+        GETFILE_SECONDS.observe(elapsed, dc_id)
+        GETFILE_OUTCOMES.inc(dc_id, "ok")
+        self.latency = 0.8 * self.latency + 0.2 * elapsed
+        self.chunk_sizer.record(dc_id, chunk_size, elapsed)
+        return result.bytes
+
+    def dc_available(self, dc_id: int) -> bool:
+        """Returns False while the circuit breaker of the DC is open."""
+        breaker = self.breakers.get(dc_id)
+        return breaker is None or breaker.available()
+
+    def plan_file(self, properties: Dict[str, Union[FileId, str, int]], from_bytes: int,
+                  until_bytes: int) -> List[Part]:
+        """
+        Plans the GetFile requests for a range, starting with a small request sized
+        for the file's DC unless the first chunk is already in the disk cache.
+        """
+        file_id_obj = properties["file_id"]
+        first_limit = self.chunk_sizer.first_limit(file_id_obj.dc_id)
+        if self.disk_cache.has_range(file_id_obj.media_id, from_bytes, from_bytes):
+            first_limit = self.disk_cache.chunk_size
+        return plan_parts(from_bytes, until_bytes, self.disk_cache.chunk_size, first_limit)
+
+    async def read_range(self, message_id: int, properties: Dict[str, Union[FileId, str, int]],
+                         offset: int, length: int) -> bytes:
+        """Returns `length` bytes at `offset`, read through the disk cache."""
+        chunk_size = self.disk_cache.chunk_size
+        chunks = self.prefetch_file(message_id, plan_parts(offset, offset + length - 1, chunk_size, chunk_size))
         try:
-            message = await self.client.get_messages(Var.BIN_CHANNEL, message_ids=int(file_id))
-            if not message:
-                logging.error(f"Message not found for ID: {file_id}")
-                return b""
-
-            media = message.document or message.video or message.audio or message.photo or message.voice
-            if not media:
-                logging.error(f"No media found in message: {file_id}")
-                return b""
-
-            # Get file ID information
-            file_id_obj = FileId.decode(media.file_id)
-            
-            # Get the file reference
-            file_reference = file_id_obj.file_reference
-
-            # Create session to download the chunk
-            session = Session(self.client, await Auth(self.client, file_id_obj.dc_id, False).create())
-            
-            # Calculate download parameters
-            download_args = (
-                file_id_obj.media_id,
-                file_id_obj.access_hash,
-                file_reference,
-                offset,
-                chunk_size  # Download chunk by chunk
+            return b"".join([bytes(chunk) async for chunk in chunks])
+        finally:
+            await chunks.aclose()
+
+    async def get_container_index(self, message_id: int) -> Optional[Dict]:
+        """
+        Returns the seek index of a MP4 or Matroska file, probing the container on
+        first access. The result is kept with the file metadata and in the file index.
+        """
+        properties = await self.get_file_properties(message_id)
+        if container_index.container_format(properties["mime_type"]) is None:
+            return None
+        if "container" not in properties:
+            await self.probes.do(int(message_id), lambda: self._probe_container(message_id, properties))
+        return properties.get("container")
+
+    async def _probe_container(self, message_id: int, properties: Dict[str, Union[FileId, str, int]]):
+        try:
+            index = await container_index.probe(
+                lambda offset, length: self.read_range(message_id, properties, offset, length),
+                properties["file_size"], properties["mime_type"]
             )
-            
-            # Download the file chunk
-            result = await session.send(
-                raw.functions.upload.GetFile(
-                    location=raw.types.InputDocumentFileLocation(*download_args),
-                    offset=offset,
-                    limit=chunk_size  # Maximum chunk size
-                )
+        except ContainerError as e:
+            logging.warning(f"Not indexing {message_id}: {e}")
+            index = None
+        except ChunkFetchError as e:
+            # Worth another try on the next access
+            logging.warning(f"Couldn't probe {message_id}: {e}")
+            return
+        properties["container"] = index
+        if self.file_index is None:
+            return
+        try:
+            await self.file_index.save_container(message_id, index)
+        except PyMongoError as e:
+            logging.warning(f"Couldn't store the container index of {message_id}: {e}")
+
+    async def warm_container_index(self, message_id: int):
+        """
+        Run alongside the first request of a video: probes its container, or
+        prefetches the already known moov/Cues region into the disk cache so the
+        player's request for it doesn't wait for Telegram.
+        """
+        properties = await self.get_file_properties(message_id)
+        known = "container" in properties
+        index = await self.get_container_index(message_id)
+        if known and index and self.disk_cache.enabled and \
+                not self.disk_cache.has_range(properties["file_id"].media_id, index["index_offset"],
+                                              index["index_offset"] + index["index_size"] - 1):
+            await self.read_range(message_id, properties, index["index_offset"], index["index_size"])
+
+    @staticmethod
+    def thumbnail_file_id(properties: Dict[str, Union[FileId, str, int]]) -> Optional[FileId]:
+        """
+        File id of the stored thumbnail, derived from the media's so it shares
+        its file reference. None when the media has no thumbnail.
+        """
+        if not properties.get("thumb_size"):
+            return None
+        file_id = properties["file_id"]
+        return FileId(
+            file_type=FileType.PHOTO if file_id.file_type == FileType.PHOTO else FileType.THUMBNAIL,
+            dc_id=file_id.dc_id,
+            media_id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumbnail_source=ThumbnailSource.THUMBNAIL,
+            thumbnail_file_type=file_id.file_type,
+            thumbnail_size=properties["thumb_size"],
+            volume_id=0,
+            local_id=0
+        )
+
+    async def get_thumbnail(self, message_id: int) -> Optional[bytes]:
+        """Returns the thumbnail of a file from the thumbnail cache, downloading it on a miss."""
+        properties = await self.get_file_properties(message_id)
+        if "thumb_size" not in properties:
+            # Indexed before thumbnails were recorded
+            properties = await self.refresh_file_properties(message_id)
+        if not properties.get("thumb_size"):
+            return None
+        key = f"{properties['unique_id']}_{properties['thumb_size']}"
+        data = await self.thumbnails.get(key)
+        if data is None:
+            data = await self.thumbnail_requests.do(key, lambda: self._download_thumbnail(message_id, properties, key))
+        return data
+
+    async def _download_thumbnail(self, message_id: int, properties: Dict[str, Union[FileId, str, int]],
+                                  key: str) -> bytes:
+        parts = []
+        while True:
+            data, properties = await self._get_file(
+                message_id, properties, self.thumbnail_file_id, len(parts) * THUMBNAIL_LIMIT, THUMBNAIL_LIMIT
             )
-            
-            # Extract the bytes from the result
-            await session.stop()
-            return result.bytes
-            
-        except Exception as e:
-            logging.error(f"Error yielding file: {str(e)}")
-            return b""
+            parts.append(data)
+            # Thumbnails take a single request, anything larger is read until the short last part
+            if len(data) < THUMBNAIL_LIMIT:
+                break
+        data = b"".join(parts)
+        await self.thumbnails.set(key, data)
+        return data
 
+    def prefetch_file(self, file_id: str, parts: List[Part], window: int = Var.PREFETCH_CHUNKS,
+                      flow: Optional[Flow] = None) -> AsyncGenerator[memoryview, None]:
+        """
+        Yields the trimmed data of the planned parts in order while keeping up to
+        `window` GetFile requests in flight ahead of the consumer. Outstanding
+        fetches are cancelled when the generator is closed, e.g. on client disconnect.
+        """
+        return self.prefetch_parts(((file_id, part) for part in parts), window, flow)
+
+    async def prefetch_parts(self, parts: Iterable[Tuple[int, Part]], window: int = Var.PREFETCH_CHUNKS,
+                             flow: Optional[Flow] = None) -> AsyncGenerator[memoryview, None]:
+        """
+        Like prefetch_file for (message_id, part) pairs of several files, the
+        window runs across file boundaries so the next file is already being
+        fetched while the end of the current one is written.
+        """
+        pending = deque()
+        parts = iter(parts)
+
+        def schedule():
+            for file_id, part in parts:
+                pending.append(asyncio.ensure_future(self.yield_file(
+                    file_id, part.offset, part.limit, part.first_part_cut, part.last_part_cut, flow
+                )))
+                return
 
-# Initialize the streamer but don't create the cache cleaner task yet
+        try:
+            for _ in range(max(1, window)):
+                schedule()
+            while pending:
+                chunk = await pending.popleft()
+                schedule()
+                yield chunk
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+
+# The first client's streamer, its client is set once the bot has started
 streamer = ByteStreamer(None)  # We'll set the client later
 
+# One streamer per client of the multi-client pool, keyed like bot.multi_clients
+streamers = {0: streamer}
+
 # Function to properly initialize the streamer with the client
 def initialize_streamer(client):
     global streamer
     streamer.client = client
+    streamer.session_pool.client = client
+
+
+def select_streamer() -> ByteStreamer:
+    """
+    Returns the streamer with the fewest active streams, ties going to the lowest recent GetFile latency.
+    """
+    return min(streamers.values(), key=lambda s: (s.active_streams, s.latency))
+
+
+def collect_streamer_metrics():
+    """Exposes the counters kept by the streamers, their caches and session pools on /metrics."""
+    metadata = Counter("webstreamer_metadata_cache_total", "Metadata cache lookups by client and result",
+                       ("client", "result"), registry=None)
+    pool = Gauge("webstreamer_media_sessions", "Pooled media sessions by client, DC and state",
+                 ("client", "dc", "state"), registry=None)
+    breakers = Gauge("webstreamer_circuit_open", "1 while the circuit breaker of a DC is open", ("client", "dc"),
+                     registry=None)
+    for client_id, byte_streamer in streamers.items():
+        cache_stats = byte_streamer.file_cache.stats()
+        for result in ("hits", "stale_hits", "misses"):
+            metadata.inc(client_id, result, amount=cache_stats[result])
+        for dc_id, pool_stats in byte_streamer.session_pool.stats().items():
+            for state in ("active", "idle"):
+                pool.set(pool_stats[state], client_id, dc_id, state)
+        for dc_id, breaker in byte_streamer.breakers.items():
+            breakers.set(1 if breaker.state == "open" else 0, client_id, dc_id)
+
+    disk_stats = chunk_cache.stats()
+    disk = Counter("webstreamer_disk_cache_total", "Disk chunk cache lookups by result", ("result",), registry=None)
+    disk.inc("hit", amount=disk_stats["hits"])
+    disk.inc("miss", amount=disk_stats["misses"])
+    disk_saved = Counter("webstreamer_disk_cache_saved_bytes_total", "Bytes served from the disk cache instead of Telegram",
+                         registry=None)
+    disk_saved.inc(amount=disk_stats["bytes_saved"])
+    disk_size = Gauge("webstreamer_disk_cache_bytes", "Bytes currently held by the disk chunk cache", registry=None)
+    disk_size.set(disk_stats["cached_bytes"])
+
+    flights = Counter("webstreamer_chunk_fetches_total", "Chunk downloads started or joined by a concurrent request",
+                      ("result",), registry=None)
+    flight_stats = chunk_requests.stats()
+    flights.inc("started", amount=flight_stats["started"])
+    flights.inc("shared", amount=flight_stats["shared"])
+    return [metadata, pool, breakers, disk, disk_saved, disk_size, flights]
+
+
+COLLECTORS.append(collect_streamer_metrics)
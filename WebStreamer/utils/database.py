@@ -1,14 +1,51 @@
 # (c) @AbirHasan2005
 
+import logging
 import datetime
 import motor.motor_asyncio
+from collections import OrderedDict
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from WebStreamer.vars import Var
+from WebStreamer.utils.cache import TTLCache
 
 
 class Database:
-    def __init__(self, uri, database_name):
+    def __init__(self, uri, database_name, known_users_size=Var.KNOWN_USERS_CACHE_SIZE):
         self._client = motor.motor_asyncio.AsyncIOMotorClient(uri)
         self.db = self._client[database_name]
         self.col = self.db.users
+        self.broadcasts = self.db.broadcasts
+        # BIN_CHANNEL files keyed by message id, so streaming doesn't need get_messages
+        self.files = self.db.files
+        # Bounded LRU set of user ids known to be in the DB, returning users skip Mongo
+        self.known_users: "OrderedDict[int, None]" = OrderedDict()
+        self.known_users_size = max(0, known_users_size)
+        self._users_count = TTLCache(maxsize=1, ttl=60, stale_ttl=3600)
+
+    async def setup(self):
+        """Creates the unique index on `id` and warms the known users with the latest ones."""
+        try:
+            await self.col.create_index('id', unique=True)
+        except PyMongoError as e:
+            # Usually duplicates left by the old find_one + insert_one path
+            logging.warning(f"Couldn't create the unique index on users.id: {e}")
+        if not self.known_users_size:
+            return
+        try:
+            cursor = self.col.find({}, {'id': 1, '_id': 0}).sort('_id', -1).limit(self.known_users_size)
+            async for user in cursor:
+                self.known_users[int(user['id'])] = None
+                self.known_users.move_to_end(int(user['id']), last=False)
+        except PyMongoError as e:
+            logging.warning(f"Couldn't load the known users: {e}")
+
+    def _remember(self, id):
+        if not self.known_users_size:
+            return
+        self.known_users[id] = None
+        self.known_users.move_to_end(id)
+        while len(self.known_users) > self.known_users_size:
+            self.known_users.popitem(last=False)
 
     def new_user(self, id):
         return dict(
@@ -16,21 +53,104 @@ class Database:
             join_date=datetime.date.today().isoformat()
         )
 
-    async def add_user(self, id):
+    async def add_user_if_new(self, id) -> bool:
+        """Adds the user with a single upsert, returns True if they weren't in the DB yet."""
+        id = int(id)
+        if id in self.known_users:
+            self.known_users.move_to_end(id)
+            return False
         user = self.new_user(id)
-        await self.col.insert_one(user)
+        del user['id']
+        try:
+            result = await self.col.update_one({'id': id}, {'$setOnInsert': user}, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent upsert of the same user won the race
+            self._remember(id)
+            return False
+        self._remember(id)
+        if result.upserted_id is None:
+            return False
+        count = self._users_count.get('users')
+        if count is not None:
+            self._users_count.set('users', count + 1)
+        return True
+
+    async def add_user(self, id):
+        await self.add_user_if_new(id)
 
     async def is_user_exist(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        if int(id) in self.known_users:
+            return True
+        user = await self.col.find_one({'id': int(id)}, {'_id': 1})
+        if user:
+            self._remember(int(id))
         return True if user else False
 
     async def total_users_count(self):
         count = await self.col.count_documents({})
         return count
 
+    async def estimated_users_count(self):
+        """Cheap metadata based count, cached for a minute, for /status."""
+        return await self._users_count.get_or_load('users', self.col.estimated_document_count)
+
     async def get_all_users(self):
         all_users = self.col.find({})
         return all_users
 
+    async def get_users_after(self, last_id, limit):
+        """Returns the next `limit` users in `_id` order, after `last_id` if given."""
+        query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+        return await self.col.find(query, {'id': 1}).sort('_id', 1).limit(limit).to_list(length=limit)
+
     async def delete_user(self, user_id):
+        self.known_users.pop(int(user_id), None)
+        self._users_count.invalidate('users')
         await self.col.delete_many({'id': int(user_id)})
+
+    async def delete_users(self, user_ids):
+        for user_id in user_ids:
+            self.known_users.pop(int(user_id), None)
+        self._users_count.invalidate('users')
+        await self.col.delete_many({'id': {'$in': [int(user_id) for user_id in user_ids]}})
+
+    async def save_file(self, message_id, bot_id, properties):
+        """Indexes a BIN_CHANNEL file, file ids are only valid for the bot they were issued to."""
+        file_id = properties['file_id']
+        await self.files.update_one(
+            {'_id': int(message_id)},
+            {'$set': {
+                'unique_id': properties['unique_id'],
+                'date': properties['date'],
+                'file_size': properties['file_size'],
+                'mime_type': properties['mime_type'],
+                'file_name': properties['file_name'],
+                'media_type': properties['media_type'],
+                'thumb_size': properties.get('thumb_size', ''),
+                'dc_id': file_id.dc_id,
+                'media_id': file_id.media_id,
+                f'locations.{bot_id}': file_id.encode()
+            }},
+            upsert=True
+        )
+
+    async def save_container(self, message_id, container):
+        await self.files.update_one({'_id': int(message_id)}, {'$set': {'container': container}})
+
+    async def get_file(self, message_id):
+        return await self.files.find_one({'_id': int(message_id)})
+
+    async def save_broadcast(self, broadcast_id, checkpoint):
+        await self.broadcasts.update_one(
+            {'_id': broadcast_id}, {'$set': dict(checkpoint, finished=False)}, upsert=True
+        )
+
+    async def finish_broadcast(self, broadcast_id):
+        await self.broadcasts.update_one({'_id': broadcast_id}, {'$set': {'finished': True}})
+
+    async def get_unfinished_broadcasts(self):
+        return await self.broadcasts.find({'finished': False}).to_list(length=None)
+
+
+# Shared by the plugins so they use one Mongo client and one known users cache
+db = Database(Var.DATABASE_URL, Var.SESSION_NAME)
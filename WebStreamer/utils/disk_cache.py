@@ -0,0 +1,265 @@
+# This file is a part of TG-FileStreamBot
+
+import os
+import math
+import time
+import logging
+import aiofiles
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from WebStreamer.vars import Var
+
+
+class CachedFile:
+    def __init__(self, media_id: int, file_size: int, chunk_size: int, bitmap: Optional[bytearray] = None):
+        self.media_id = media_id
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.chunk_count = math.ceil(file_size / chunk_size) if file_size else 0
+        self.bitmap = bitmap if bitmap is not None else bytearray(math.ceil(self.chunk_count / 8))
+        self.cached_bytes = sum(self.chunk_length(i) for i in range(self.chunk_count) if self.has_chunk(i))
+        self.last_access = time.time()
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.file_size - index * self.chunk_size)
+
+    def has_chunk(self, index: int) -> bool:
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def mark_chunk(self, index: int):
+        self.bitmap[index >> 3] |= 1 << (index & 7)
+
+
+class ChunkDiskCache:
+    """
+    On-disk cache of downloaded chunks.
+
+    Every media gets a sparse file of its full size, named after its media_id,
+    plus a bitmap of the chunks already written to it. Whole files are evicted
+    in least-recently-used order to stay under `max_bytes` of cached data.
+    """
+
+    def __init__(self, cache_dir: str = Var.CACHE_DIR, max_bytes: int = Var.CACHE_MAX_SIZE * 1024 * 1024,
+                 chunk_size: int = 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.files: "OrderedDict[int, CachedFile]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        self._loaded = False
+        # Chunks downloaded in several smaller parts, keyed by (media_id, chunk index)
+        self._partial: "OrderedDict[Tuple[int, int], Dict[int, bytes]]" = OrderedDict()
+        self.max_partial_chunks = 16
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def data_path(self, media_id: int) -> str:
+        return os.path.join(self.cache_dir, f"{media_id}.bin")
+
+    def bitmap_path(self, media_id: int) -> str:
+        return os.path.join(self.cache_dir, f"{media_id}.map")
+
+    def _ensure_loaded(self):
+        """Rebuilds the index from the bitmaps left on disk by a previous run."""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for name in os.listdir(self.cache_dir):
+            root, extension = os.path.splitext(name)
+            try:
+                media_id = int(root)
+            except ValueError:
+                # Not one of ours, e.g. the thumbnail directory
+                continue
+            if extension == ".bin" and not os.path.exists(self.bitmap_path(media_id)):
+                # Created but never completed a chunk
+                os.remove(os.path.join(self.cache_dir, name))
+            if extension != ".map":
+                continue
+            try:
+                file_size = os.path.getsize(self.data_path(media_id))
+                with open(self.bitmap_path(media_id), "rb") as f:
+                    bitmap = bytearray(f.read())
+                entry = CachedFile(media_id, file_size, self.chunk_size, bitmap)
+                entry.last_access = os.path.getmtime(self.bitmap_path(media_id))
+                found.append(entry)
+            except (OSError, ValueError, IndexError) as e:
+                logging.warning(f"Discarding unreadable cache entry {name}: {e}")
+                self._remove_files(media_id)
+        for entry in sorted(found, key=lambda e: e.last_access):
+            self.files[entry.media_id] = entry
+            self.total_bytes += entry.cached_bytes
+
+    def _entry(self, media_id: int) -> Optional[CachedFile]:
+        self._ensure_loaded()
+        entry = self.files.get(media_id)
+        if entry is not None:
+            entry.last_access = time.time()
+            self.files.move_to_end(media_id)
+        return entry
+
+    def has_range(self, media_id: int, from_bytes: int, until_bytes: int) -> bool:
+        """Returns True if every chunk covering [from_bytes, until_bytes] is cached."""
+        if not self.enabled:
+            return False
+        entry = self._entry(media_id)
+        if entry is None:
+            return False
+        first = from_bytes // self.chunk_size
+        last = until_bytes // self.chunk_size
+        return all(entry.has_chunk(i) for i in range(first, last + 1))
+
+    def record_served(self, length: int):
+        """Accounts a range served straight from the cache file (sendfile path)."""
+        self.hits += 1
+        self.bytes_saved += length
+
+    async def read_chunk(self, media_id: int, index: int) -> Optional[bytes]:
+        """Returns the cached chunk or None, counting the lookup as a hit or miss."""
+        if not self.enabled:
+            return None
+        entry = self._entry(media_id)
+        if entry is None or index >= entry.chunk_count or not entry.has_chunk(index):
+            self.misses += 1
+            return None
+        try:
+            async with aiofiles.open(self.data_path(media_id), "rb") as f:
+                await f.seek(index * self.chunk_size)
+                data = await f.read(entry.chunk_length(index))
+        except OSError as e:
+            logging.warning(f"Dropping cache entry {media_id}: {e}")
+            self.evict(media_id)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes_saved += len(data)
+        return data
+
+    async def write_chunk(self, media_id: int, file_size: int, index: int, data: bytes):
+        """Stores a complete chunk, evicting least recently used files to fit the budget."""
+        if not self.enabled or not file_size or len(data) > self.max_bytes:
+            return
+        entry = self._entry(media_id)
+        created = entry is None
+        if created:
+            entry = CachedFile(media_id, file_size, self.chunk_size)
+        if index >= entry.chunk_count or entry.has_chunk(index) or len(data) != entry.chunk_length(index):
+            return
+        # Make room before creating anything, a file that doesn't fit is never started
+        self._make_room(len(data), keep=media_id)
+        if self.total_bytes + len(data) > self.max_bytes:
+            return
+        if created:
+            try:
+                with open(self.data_path(media_id), "wb") as f:
+                    f.truncate(file_size)
+            except OSError as e:
+                logging.warning(f"Couldn't create cache file for {media_id}: {e}")
+                return
+            self.files[media_id] = entry
+        try:
+            async with aiofiles.open(self.data_path(media_id), "r+b") as f:
+                await f.seek(index * self.chunk_size)
+                await f.write(data)
+            if self.files.get(media_id) is not entry or entry.has_chunk(index):
+                # Evicted or written by a concurrent request while we were writing
+                return
+            entry.mark_chunk(index)
+            async with aiofiles.open(self.bitmap_path(media_id), "wb") as f:
+                await f.write(bytes(entry.bitmap))
+        except OSError as e:
+            logging.warning(f"Couldn't write chunk {index} of {media_id} to cache: {e}")
+            self.evict(media_id)
+            return
+        entry.cached_bytes += len(data)
+        self.total_bytes += len(data)
+
+    async def write_part(self, media_id: int, file_size: int, offset: int, data: bytes):
+        """
+        Stores downloaded data of any aligned part. Parts smaller than a chunk are
+        held in memory until they add up to the whole chunk, which is then written.
+        """
+        if not self.enabled or not file_size or offset >= file_size:
+            return
+        index = offset // self.chunk_size
+        block = index * self.chunk_size
+        length = min(self.chunk_size, file_size - block)
+        if offset == block and len(data) == length:
+            await self.write_chunk(media_id, file_size, index, data)
+            return
+        entry = self.files.get(media_id)
+        if entry is not None and entry.has_chunk(index):
+            return
+
+        key = (media_id, index)
+        parts = self._partial.setdefault(key, {})
+        self._partial.move_to_end(key)
+        parts[offset - block] = bytes(data)
+        while len(self._partial) > self.max_partial_chunks:
+            self._partial.popitem(last=False)
+
+        covered = 0
+        for start in sorted(parts):
+            if start > covered:
+                return
+            covered = max(covered, start + len(parts[start]))
+        if covered < length:
+            return
+        chunk = bytearray(length)
+        for start, part in parts.items():
+            chunk[start:start + len(part)] = part[:length - start]
+        del self._partial[key]
+        await self.write_chunk(media_id, file_size, index, bytes(chunk))
+
+    def _make_room(self, length: int, keep: int):
+        for media_id in list(self.files):
+            if self.total_bytes + length <= self.max_bytes:
+                break
+            if media_id != keep:
+                self.evict(media_id)
+
+    def evict(self, media_id: int):
+        entry = self.files.pop(media_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.cached_bytes
+            self.evictions += 1
+        self._remove_files(media_id)
+
+    def _remove_files(self, media_id: int):
+        for path in (self.data_path(media_id), self.bitmap_path(media_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "files": len(self.files),
+            "cached_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+        }
+
+
+# Shared by every ByteStreamer, chunks are keyed by media_id which doesn't depend on the client.
+# Worker processes each get their own directory and share of the budget, the index isn't shared.
+if Var.PROCESSES > 1:
+    chunk_cache = ChunkDiskCache(
+        os.path.join(Var.CACHE_DIR, f"worker{Var.WORKER_INDEX}"),
+        Var.CACHE_MAX_SIZE * 1024 * 1024 // Var.PROCESSES
+    )
+else:
+    chunk_cache = ChunkDiskCache()
@@ -0,0 +1,9 @@
+# This file is a part of TG-FileStreamBot
+
+
+class FileNotFound(Exception):
+    """Raised when a BIN_CHANNEL message doesn't exist or has no media."""
+
+
+class ChunkFetchError(Exception):
+    """Raised when a chunk couldn't be downloaded from Telegram, retries included."""
@@ -0,0 +1,96 @@
+# This file is a part of TG-FileStreamBot
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from pyrogram.types import Message
+from WebStreamer.vars import Var
+from WebStreamer.utils.rate_limiter import TokenBucket
+from WebStreamer.utils.retry import flood_wait_seconds
+
+# forward_messages accepts up to 100 message ids
+MAX_BATCH = 100
+
+
+class Batch:
+    def __init__(self, client: Client, kind: str, message: Message):
+        self.client = client
+        self.kind = kind
+        self.messages: List[Message] = [message]
+
+
+class IngestQueue:
+    """
+    Queue of uploads to forward to the BIN_CHANNEL.
+
+    Messages of the same kind, chat and media group arriving within `window`
+    seconds are handed to `process` as one batch, so an album costs a single
+    forward_messages call. Workers send every request through `call`, paced by
+    a token bucket shared by all workers; a FloodWait pauses the bucket and
+    delays the queue instead of blocking Pyrogram's update handlers. At most
+    `maxsize` messages are queued, `submit` waits for room beyond that.
+    """
+
+    def __init__(self, process: Callable[["IngestQueue", Batch], Awaitable[None]],
+                 maxsize: int = Var.INGEST_QUEUE_SIZE, workers: int = Var.INGEST_WORKERS,
+                 rate: float = Var.INGEST_RATE, window: float = 0.5):
+        self.process = process
+        self.workers = max(1, workers)
+        self.window = window
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.queue: Optional[asyncio.Queue] = None
+        self._slots = asyncio.Semaphore(max(1, maxsize))
+        self._pending: Dict[Hashable, Batch] = {}
+        self._tasks = []
+
+    def _ensure_started(self):
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, client: Client, message: Message, kind: str):
+        self._ensure_started()
+        await self._slots.acquire()
+        key = (kind, message.chat.id, message.media_group_id)
+        batch = self._pending.get(key)
+        if batch is not None and len(batch.messages) < MAX_BATCH:
+            batch.messages.append(message)
+            return
+        batch = self._pending[key] = Batch(client, kind, message)
+        asyncio.get_running_loop().call_later(self.window, self._flush, key, batch)
+
+    def _flush(self, key: Hashable, batch: Batch):
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        self.queue.put_nowait(batch)
+
+    async def _worker(self):
+        while True:
+            batch = await self.queue.get()
+            try:
+                await self.process(self, batch)
+            except Exception:
+                logging.exception(f"Couldn't process {len(batch.messages)} {batch.kind} upload(s)")
+            finally:
+                for _ in batch.messages:
+                    self._slots.release()
+
+    async def call(self, function: Callable[..., Awaitable], *args, **kwargs):
+        """Runs a Telegram request at the queue's pace, waiting out FloodWaits."""
+        while True:
+            await self.bucket.acquire()
+            try:
+                return await function(*args, **kwargs)
+            except FloodWait as e:
+                wait = flood_wait_seconds(e)
+                logging.warning(f"Ingestion got a FloodWait of {wait}s, pausing the queue")
+                self.bucket.pause(wait)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "pending": sum(len(batch.messages) for batch in self._pending.values()),
+        }
@@ -0,0 +1,191 @@
+# This file is a part of TG-FileStreamBot
+
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List
+from WebStreamer.vars import Var
+from pyrogram import Client, raw
+from pyrogram.errors import AuthBytesInvalid
+from pyrogram.session import Session, Auth
+
+
+async def invoke(client: Client, query):
+    """Invoke a raw function on the main client (Pyrogram 1.x uses send, 2.x uses invoke)."""
+    if hasattr(client, "invoke"):
+        return await client.invoke(query)
+    return await client.send(query)
+
+
+def is_session_alive(session: Session) -> bool:
+    """Checks the started/connected flag of a Pyrogram session across versions."""
+    event = getattr(session, "is_started", None) or getattr(session, "is_connected", None)
+    return event is None or event.is_set()
+
+
+class PooledSession:
+    def __init__(self, dc_id: int, session: Session):
+        self.dc_id = dc_id
+        self.session = session
+        self.in_flight = 0
+        self.requests = 0
+        self.created_at = time.time()
+        self.last_used = time.time()
+
+
+class MediaSessionPool:
+    """
+    Long-lived media sessions keyed by DC id.
+
+    Sessions are created lazily on the first request for a DC and reused across
+    chunks and HTTP requests. Up to `size_per_dc` connections are opened per DC,
+    a new one only being created when every existing connection is busy.
+    Sessions that fail with a network error are dropped and transparently
+    recreated on the next acquire.
+    """
+
+    def __init__(self, client: Client, size_per_dc: int = Var.MEDIA_SESSIONS_PER_DC):
+        self.client = client
+        self.size_per_dc = max(1, size_per_dc)
+        self._sessions: Dict[int, List[PooledSession]] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._dropped: Dict[int, int] = {}
+        self._health_checker = None
+
+    @asynccontextmanager
+    async def acquire(self, dc_id: int):
+        """Yields a started media session for the given DC."""
+        pooled = await self._get(dc_id)
+        pooled.in_flight += 1
+        pooled.requests += 1
+        try:
+            yield pooled.session
+        except ConnectionError:
+            await self.discard(pooled)
+            raise
+        except (OSError, asyncio.TimeoutError):
+            # TimeoutError is an OSError: a single slow request leaves the connection,
+            # shared with other streams, in the pool unless it actually went down
+            if not is_session_alive(pooled.session):
+                await self.discard(pooled)
+            raise
+        finally:
+            pooled.in_flight -= 1
+            pooled.last_used = time.time()
+
+    async def _get(self, dc_id: int) -> PooledSession:
+        sessions = self._sessions.setdefault(dc_id, [])
+        alive = [s for s in sessions if is_session_alive(s.session)]
+        if alive:
+            least_busy = min(alive, key=lambda s: s.in_flight)
+            if least_busy.in_flight == 0 or len(sessions) >= self.size_per_dc:
+                return least_busy
+
+        lock = self._locks.setdefault(dc_id, asyncio.Lock())
+        async with lock:
+            # Another request may have opened a connection while we waited
+            sessions = self._sessions[dc_id]
+            for dead in [s for s in sessions if not is_session_alive(s.session)]:
+                await self.discard(dead)
+            idle = [s for s in sessions if s.in_flight == 0]
+            if idle:
+                return idle[0]
+            if len(sessions) >= self.size_per_dc:
+                return min(sessions, key=lambda s: s.in_flight)
+            pooled = PooledSession(dc_id, await self._create_session(dc_id))
+            sessions.append(pooled)
+            logging.info(f"Opened media session {len(sessions)}/{self.size_per_dc} for DC {dc_id}")
+            return pooled
+
+    async def _create_session(self, dc_id: int) -> Session:
+        client = self.client
+        test_mode = await client.storage.test_mode()
+        if dc_id != await client.storage.dc_id():
+            session = Session(
+                client, dc_id, await Auth(client, dc_id, test_mode).create(),
+                test_mode, is_media=True
+            )
+            await session.start()
+            for _ in range(6):
+                exported_auth = await invoke(client, raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+                try:
+                    await session.send(
+                        raw.functions.auth.ImportAuthorization(
+                            id=exported_auth.id,
+                            bytes=exported_auth.bytes
+                        )
+                    )
+                    break
+                except AuthBytesInvalid:
+                    logging.debug(f"Invalid authorization bytes for DC {dc_id}, retrying")
+                    continue
+            else:
+                await session.stop()
+                raise AuthBytesInvalid
+        else:
+            session = Session(
+                client, dc_id, await client.storage.auth_key(),
+                test_mode, is_media=True
+            )
+            await session.start()
+        return session
+
+    async def discard(self, pooled: PooledSession):
+        """Removes a session from the pool and stops it."""
+        sessions = self._sessions.get(pooled.dc_id, [])
+        if pooled not in sessions:
+            return
+        sessions.remove(pooled)
+        self._dropped[pooled.dc_id] = self._dropped.get(pooled.dc_id, 0) + 1
+        logging.warning(f"Dropping media session for DC {pooled.dc_id}")
+        try:
+            await pooled.session.stop()
+        except Exception as e:
+            logging.debug(f"Error stopping media session: {e}")
+
+    async def start_health_checker(self):
+        """Starts the periodic health check task. Must be called with a running loop."""
+        if self._health_checker is None:
+            self._health_checker = asyncio.create_task(self.health_check())
+
+    async def health_check(self):
+        """Pings idle sessions and drops the ones that no longer answer."""
+        while True:
+            await asyncio.sleep(Var.SESSION_HEALTH_CHECK_INTERVAL)
+            for sessions in list(self._sessions.values()):
+                for pooled in list(sessions):
+                    if pooled.in_flight:
+                        continue
+                    if not is_session_alive(pooled.session):
+                        await self.discard(pooled)
+                        continue
+                    try:
+                        await pooled.session.send(raw.functions.Ping(ping_id=0), timeout=10)
+                    except Exception as e:
+                        logging.warning(f"Health check failed for DC {pooled.dc_id}: {e}")
+                        await self.discard(pooled)
+
+    async def close(self):
+        """Stops every pooled session."""
+        if self._health_checker is not None:
+            self._health_checker.cancel()
+            self._health_checker = None
+        for sessions in list(self._sessions.values()):
+            for pooled in list(sessions):
+                await self.discard(pooled)
+
+    def stats(self) -> Dict[int, Dict[str, int]]:
+        """Returns active/idle session counts per DC for sizing the pool."""
+        stats = {}
+        for dc_id, sessions in self._sessions.items():
+            active = sum(1 for s in sessions if s.in_flight)
+            stats[dc_id] = {
+                "sessions": len(sessions),
+                "active": active,
+                "idle": len(sessions) - active,
+                "in_flight": sum(s.in_flight for s in sessions),
+                "requests": sum(s.requests for s in sessions),
+                "dropped": self._dropped.get(dc_id, 0),
+            }
+        return stats
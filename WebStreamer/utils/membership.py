@@ -0,0 +1,64 @@
+# This file is a part of TG-FileStreamBot
+
+from pyrogram import Client
+from pyrogram.errors import UserNotParticipant
+from WebStreamer.vars import Var
+from WebStreamer.utils.cache import TTLCache
+
+MEMBER = "member"
+NOT_MEMBER = "not_member"
+BANNED = "banned"
+
+
+class MembershipChecker:
+    """
+    Cached UPDATES_CHANNEL membership checks.
+
+    Members are remembered for `ttl` seconds. Non members only for
+    `negative_ttl` seconds, enough to absorb a burst of uploads, and a retry
+    (/start, /help or the Refresh button) skips a cached negative result so a
+    user who just joined isn't turned away. Concurrent checks of the same user
+    share one get_chat_member call.
+    """
+
+    def __init__(self, channel: str = Var.UPDATES_CHANNEL, maxsize: int = 10000,
+                 ttl: float = Var.MEMBERSHIP_CACHE_TTL, negative_ttl: float = Var.MEMBERSHIP_NEGATIVE_TTL):
+        self.channel = channel
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(maxsize, ttl)
+
+    @property
+    def enabled(self) -> bool:
+        return self.channel != "None"
+
+    async def check(self, client: Client, user_id: int, retry: bool = False) -> str:
+        """
+        Returns MEMBER or BANNED, raises UserNotParticipant for users who haven't joined.
+        Other errors of get_chat_member are raised and not cached.
+        """
+        if not self.enabled:
+            return MEMBER
+        if retry and user_id in self.cache and self.cache.get(user_id) != MEMBER:
+            self.cache.invalidate(user_id)
+        status = await self.cache.get_or_load(user_id, lambda: self._fetch(client, user_id), ttl=self._ttl)
+        if status == NOT_MEMBER:
+            raise UserNotParticipant
+        return status
+
+    def _ttl(self, status: str) -> float:
+        return self.cache.ttl if status == MEMBER else self.negative_ttl
+
+    async def _fetch(self, client: Client, user_id: int) -> str:
+        try:
+            member = await client.get_chat_member(self.channel, user_id)
+        except UserNotParticipant:
+            status = NOT_MEMBER
+        else:
+            # "kicked" in Pyrogram 1.x, ChatMemberStatus.BANNED / LEFT in 2.x
+            value = getattr(member.status, "value", member.status)
+            status = BANNED if value in ("kicked", "banned") else NOT_MEMBER if value == "left" else MEMBER
+        return status
+
+
+# Shared by the plugins so every handler sees the same cached results
+membership = MembershipChecker()
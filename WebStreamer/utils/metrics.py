@@ -0,0 +1,122 @@
+# This file is a part of TG-FileStreamBot
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+REGISTRY: List["Metric"] = []
+COLLECTORS: List[Callable[[], Iterable["Metric"]]] = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        if registry is not None:
+            registry.append(self)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(Metric):
+    """Fixed-bucket histogram, an observation costs one bisect and three additions."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        self._buckets: Dict[Tuple, List[int]] = {}
+        self._sums: Dict[Tuple, float] = {}
+
+    def observe(self, value: float, *labels):
+        counts = self._buckets.get(labels)
+        if counts is None:
+            counts = self._buckets[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def samples(self) -> Iterable[str]:
+        for labels, counts in self._buckets.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {self._sums[labels]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+def render() -> str:
+    """Returns every registered and collected metric in the Prometheus text format."""
+    metrics = list(REGISTRY)
+    for collector in COLLECTORS:
+        metrics.extend(collector())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+METADATA_SECONDS = Histogram(
+    "webstreamer_metadata_lookup_seconds", "Time spent resolving file metadata, cache hits included"
+)
+SESSION_ACQUIRE_SECONDS = Histogram(
+    "webstreamer_session_acquire_seconds", "Time spent acquiring a media session", ("dc",)
+)
+GETFILE_SECONDS = Histogram(
+    "webstreamer_getfile_seconds", "Duration of upload.GetFile requests", ("dc",)
+)
+GETFILE_OUTCOMES = Counter(
+    "webstreamer_getfile_total", "upload.GetFile requests by outcome (ok, flood_wait or the error name)", ("dc", "outcome")
+)
+GETFILE_RETRIES = Counter(
+    "webstreamer_getfile_retries_total", "upload.GetFile requests retried, by the reason of the retry", ("dc", "reason")
+)
+BYTES_SERVED = Counter(
+    "webstreamer_bytes_served_total", "Bytes of media written to HTTP clients, rate() gives bytes per second", ("source",)
+)
+ACTIVE_STREAMS = Gauge(
+    "webstreamer_active_streams", "HTTP responses currently streaming from Telegram", ("dc",)
+)
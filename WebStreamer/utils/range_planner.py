@@ -0,0 +1,145 @@
+# This file is a part of TG-FileStreamBot
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# upload.GetFile limits: offset and limit are multiples of 4 KB, 1 MB is a
+# multiple of limit and a request never crosses a 1 MB boundary
+MIN_LIMIT = 4 * 1024
+MAX_LIMIT = 1024 * 1024
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when none of the requested byte ranges overlaps the file."""
+
+
+class Part(NamedTuple):
+    offset: int
+    limit: int
+    first_part_cut: int
+    last_part_cut: int
+
+
+def parse_range(range_header: str, file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parses a Range header into a list of inclusive (from_bytes, until_bytes) pairs clamped to the file.
+
+    Returns None for a header that should be ignored (malformed, not in bytes, or
+    too many ranges), in which case the whole file is sent.
+    """
+    unit, _, specs = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+    specs = [spec.strip() for spec in specs.split(",") if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.partition("-")
+        start, end = start.strip(), end.strip()
+        if not sep or not (start or end) or not (start or "0").isdigit() or not (end or "0").isdigit():
+            return None
+        if not start:
+            # Suffix range, the last `end` bytes
+            length = int(end)
+            if length == 0 or file_size == 0:
+                continue
+            ranges.append((max(0, file_size - length), file_size - 1))
+            continue
+        from_bytes = int(start)
+        if end and int(end) < from_bytes:
+            return None
+        if from_bytes >= file_size:
+            continue
+        until_bytes = int(end) if end else file_size - 1
+        ranges.append((from_bytes, min(until_bytes, file_size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable(f"bytes */{file_size}")
+    return ranges
+
+
+def plan_parts(from_bytes: int, until_bytes: int, chunk_size: int = MAX_LIMIT,
+               first_limit: int = MAX_LIMIT) -> List[Part]:
+    """
+    Returns the GetFile requests covering [from_bytes, until_bytes].
+
+    There is one request per `chunk_size` block touched by the range, each using
+    the smallest power-of-two limit that covers the wanted bytes of its block, so
+    the first and last parts of a small or unaligned range don't download a full
+    chunk. With a `first_limit` below `chunk_size` the first request is at most
+    that big and the following ones double until they reach `chunk_size`, which
+    gets the first bytes to the client sooner. The cuts are the slice of each
+    response to send to the client.
+    """
+    parts = []
+    ramp = max(MIN_LIMIT, min(first_limit, chunk_size))
+    position = from_bytes
+    while position <= until_bytes:
+        block = position - position % chunk_size
+        block_until = min(block + chunk_size - 1, until_bytes)
+        first = position - block
+        if ramp < chunk_size:
+            # Stop at the next ramp-sized boundary so the request stays aligned
+            block_until = min(block_until, block + (first // ramp + 1) * ramp - 1)
+            ramp *= 2
+        last = block_until - block
+        limit = MIN_LIMIT
+        while first // limit != last // limit:
+            limit *= 2
+        offset = block + first - first % limit
+        parts.append(Part(offset, limit, position - offset, block_until - offset + 1))
+        position = block_until + 1
+    return parts
+
+
+class ChunkSizer:
+    """
+    Picks the size of the first request of a stream per DC.
+
+    Small requests measure the round-trip time and full chunks the throughput of
+    a DC. The first request is sized to roughly one bandwidth-delay product: big
+    enough not to waste a round trip, small enough that its transfer doesn't
+    dominate the time to first byte.
+    """
+
+    def __init__(self, default_limit: int = MAX_LIMIT, min_limit: int = 64 * 1024, max_limit: int = MAX_LIMIT):
+        self.default_limit = default_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.rtt: Dict[int, float] = {}
+        self.throughput: Dict[int, float] = {}
+
+    def record(self, dc_id: int, limit: int, elapsed: float):
+        """Feeds the duration of a GetFile request into the estimates of its DC."""
+        if limit <= self.min_limit:
+            self.rtt[dc_id] = self._ewma(self.rtt.get(dc_id), elapsed)
+        elif limit >= self.max_limit // 2:
+            transfer = max(elapsed - self.rtt.get(dc_id, 0.0), 1e-3)
+            self.throughput[dc_id] = self._ewma(self.throughput.get(dc_id), limit / transfer)
+
+    @staticmethod
+    def _ewma(current: Optional[float], sample: float, alpha: float = 0.2) -> float:
+        return sample if current is None else (1 - alpha) * current + alpha * sample
+
+    def first_limit(self, dc_id: int) -> int:
+        if self.default_limit >= self.max_limit:
+            return self.max_limit
+        if dc_id not in self.rtt or dc_id not in self.throughput:
+            return self.default_limit
+        target = self.rtt[dc_id] * self.throughput[dc_id]
+        limit = self.min_limit
+        while limit * 2 <= min(target, self.max_limit):
+            limit *= 2
+        return limit
+
+    def stats(self) -> Dict[int, Dict[str, float]]:
+        return {
+            dc_id: {
+                "rtt": round(self.rtt.get(dc_id, 0.0), 4),
+                "throughput": round(self.throughput.get(dc_id, 0.0)),
+                "first_limit": self.first_limit(dc_id),
+            }
+            for dc_id in set(self.rtt) | set(self.throughput)
+        }
@@ -0,0 +1,38 @@
+# This file is a part of TG-FileStreamBot
+
+import time
+import asyncio
+
+
+class TokenBucket:
+    """
+    Token bucket limiting a rate to `rate` units per second with bursts of up to `capacity`.
+    Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        """Waits until `amount` tokens are available and takes them."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def pause(self, seconds: float):
+        """Drains the bucket so nothing is let through for `seconds`, e.g. after a FloodWait."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
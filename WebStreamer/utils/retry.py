@@ -0,0 +1,68 @@
+# This file is a part of TG-FileStreamBot
+
+import time
+import random
+import asyncio
+from WebStreamer.vars import Var
+from pyrogram.errors import FloodWait, RPCError
+
+
+def flood_wait_seconds(error: FloodWait) -> int:
+    """Seconds to wait from a FloodWait (Pyrogram 1.x uses x, 2.x uses value)."""
+    return int(getattr(error, "value", None) or getattr(error, "x", 0) or 0)
+
+
+def is_transient(error: Exception) -> bool:
+    """Network failures and Telegram server side errors are worth retrying, request errors aren't."""
+    if isinstance(error, (OSError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, RPCError) and not isinstance(error, FloodWait) and (getattr(error, "CODE", 0) or 0) >= 500
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Fails fast once a DC keeps failing.
+
+    After `threshold` consecutive transient failures the breaker opens and
+    requests are refused for `cooldown` seconds. Then a single request is let
+    through as a probe: success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, threshold: int = Var.BREAKER_THRESHOLD, cooldown: float = Var.BREAKER_COOLDOWN):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def available(self) -> bool:
+        """Returns True if a request could be sent now, without taking the probe."""
+        return self.state != "open"
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            # Re-arm so only this request probes the DC during the next cooldown
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
@@ -0,0 +1,111 @@
+# This file is a part of TG-FileStreamBot
+
+import asyncio
+import itertools
+from heapq import heappop, heappush
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from WebStreamer.vars import Var
+from WebStreamer.utils.rate_limiter import TokenBucket
+
+PLAYBACK = "playback"
+DOWNLOAD = "download"
+
+# Share of the GetFile slots given to each class of stream
+PRIORITY_WEIGHTS = {PLAYBACK: 4.0, DOWNLOAD: 1.0}
+
+
+class Flow:
+    """One HTTP stream, as seen by the scheduler."""
+
+    def __init__(self, client_ip: str, priority: str, rate_limit: int = 0):
+        self.client_ip = client_ip
+        self.priority = priority
+        self.finish_tag = 0.0
+        self.bucket = TokenBucket(rate_limit, capacity=max(rate_limit, 1024 * 1024)) if rate_limit else None
+
+
+class FairScheduler:
+    """
+    Start-time fair queuing of GetFile requests.
+
+    At most `concurrency` requests run at once. When requests have to wait, the
+    next slot goes to the one with the smallest virtual start tag. A flow's
+    weight is its priority class weight divided by the number of open flows of
+    the same client IP, so a download manager opening 16 connections gets the
+    same share as a single player on another IP, and playback outweighs
+    `?download=1` transfers.
+    """
+
+    def __init__(self, concurrency: int = Var.MAX_CONCURRENT_FETCHES):
+        self.concurrency = max(1, concurrency)
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._flows_per_ip: Dict[str, int] = {}
+        self.default_flow = Flow("", DOWNLOAD)
+
+    def open_flow(self, client_ip: str, priority: str) -> Flow:
+        rate_limit = Var.PLAYBACK_RATE_LIMIT if priority == PLAYBACK else Var.DOWNLOAD_RATE_LIMIT
+        self._flows_per_ip[client_ip] = self._flows_per_ip.get(client_ip, 0) + 1
+        return Flow(client_ip, priority, rate_limit * 1024)
+
+    def close_flow(self, flow: Flow):
+        remaining = self._flows_per_ip.get(flow.client_ip, 1) - 1
+        if remaining > 0:
+            self._flows_per_ip[flow.client_ip] = remaining
+        else:
+            self._flows_per_ip.pop(flow.client_ip, None)
+
+    def weight(self, flow: Flow) -> float:
+        return PRIORITY_WEIGHTS.get(flow.priority, 1.0) / max(1, self._flows_per_ip.get(flow.client_ip, 1))
+
+    @asynccontextmanager
+    async def slot(self, flow: Optional[Flow], cost: int):
+        """Waits for the flow's rate cap and its fair turn, then holds a GetFile slot."""
+        flow = flow or self.default_flow
+        if flow.bucket is not None:
+            await flow.bucket.acquire(cost)
+        start_tag = max(self.virtual_time, flow.finish_tag)
+        flow.finish_tag = start_tag + cost / self.weight(flow)
+
+        if self.in_use < self.concurrency and not self._waiters:
+            self.in_use += 1
+            self.virtual_time = start_tag
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heappush(self._waiters, (start_tag, next(self._sequence), waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over right before the cancellation
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._waiters:
+            start_tag, _, waiter = heappop(self._waiters)
+            if not waiter.done():
+                # Hand the slot straight to the next waiter
+                self.virtual_time = start_tag
+                waiter.set_result(None)
+                return
+        self.in_use -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_use": self.in_use,
+            "waiting": sum(1 for _, _, waiter in self._waiters if not waiter.done()),
+            "flows": sum(self._flows_per_ip.values()),
+            "client_ips": len(self._flows_per_ip),
+        }
+
+
+# Shared by every ByteStreamer so the fair share spans all clients
+scheduler = FairScheduler()
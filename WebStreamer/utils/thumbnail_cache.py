@@ -0,0 +1,122 @@
+# This file is a part of TG-FileStreamBot
+
+import os
+import logging
+import aiofiles
+from collections import OrderedDict
+from typing import Dict, Optional
+from WebStreamer.vars import Var
+from WebStreamer.utils.disk_cache import chunk_cache
+
+
+class ThumbnailCache:
+    """
+    Thumbnails kept in a memory LRU of at most `memory_bytes`, in front of a
+    directory holding up to `disk_bytes` of them. Entries are keyed by the
+    file's unique id and never change, both levels evict least recently used
+    entries first.
+    """
+
+    def __init__(self, cache_dir: str, memory_bytes: int = Var.THUMB_MEMORY_CACHE_SIZE * 1024 * 1024,
+                 disk_bytes: int = Var.THUMB_CACHE_SIZE * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_used = 0
+        # Sizes of the files on disk, least recently used first
+        self.disk: "OrderedDict[str, int]" = OrderedDict()
+        self.disk_used = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._loaded = False
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.jpg")
+
+    def _ensure_loaded(self):
+        if self._loaded or not self.disk_bytes:
+            return
+        self._loaded = True
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_used += size
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        self.memory[key] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return data
+        self._ensure_loaded()
+        if key in self.disk:
+            try:
+                async with aiofiles.open(self.path(key), "rb") as f:
+                    data = await f.read()
+            except OSError as e:
+                logging.warning(f"Couldn't read cached thumbnail {key}: {e}")
+                self.disk_used -= self.disk.pop(key)
+            else:
+                self.disk.move_to_end(key)
+                self.disk_hits += 1
+                self._remember(key, data)
+                return data
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, data: bytes):
+        self._remember(key, data)
+        self._ensure_loaded()
+        if not self.disk_bytes or key in self.disk:
+            return
+        try:
+            async with aiofiles.open(self.path(key), "wb") as f:
+                await f.write(data)
+        except OSError as e:
+            logging.warning(f"Couldn't cache thumbnail {key}: {e}")
+            return
+        self.disk[key] = len(data)
+        self.disk_used += len(data)
+        while self.disk_used > self.disk_bytes:
+            evicted, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.remove(self.path(evicted))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_used,
+            "disk_entries": len(self.disk),
+            "disk_bytes": self.disk_used,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+
+# Next to the chunk cache, worker processes get their own directory and share of the disk budget as well
+thumbnail_cache = ThumbnailCache(
+    os.path.join(chunk_cache.cache_dir, "thumbs"),
+    disk_bytes=Var.THUMB_CACHE_SIZE * 1024 * 1024 // max(1, Var.PROCESSES)
+)
@@ -0,0 +1,47 @@
+# This file is a part of TG-FileStreamBot
+
+import os
+import sys
+import time
+import signal
+import logging
+import subprocess
+from typing import Dict
+
+
+def spawn_worker(index: int) -> subprocess.Popen:
+    env = dict(os.environ, WORKER_INDEX=str(index))
+    return subprocess.Popen([sys.executable, "-m", "WebStreamer"], env=env)
+
+
+def run_workers(count: int, restart_delay: float = 5.0):
+    """
+    Runs `count` worker processes sharing the web server port, restarting any
+    worker that exits until the supervisor is interrupted or terminated.
+    """
+    workers: Dict[int, subprocess.Popen] = {index: spawn_worker(index) for index in range(count)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        while not stopping:
+            time.sleep(1)
+            for index, process in workers.items():
+                if process.poll() is not None and not stopping:
+                    logging.warning(f"Worker {index} exited with code {process.returncode}, restarting")
+                    time.sleep(restart_delay)
+                    workers[index] = spawn_worker(index)
+    finally:
+        for process in workers.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in workers.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
@@ -0,0 +1,137 @@
+# This file is a part of TG-FileStreamBot
+
+import os
+import struct
+import datetime
+from typing import List, NamedTuple
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+# Data descriptor follows the data, names are UTF-8
+FLAGS = 0x0008 | 0x0800
+VERSION = 45
+
+
+class ZipMember(NamedTuple):
+    name: bytes
+    size: int
+    offset: int
+    dos_time: int
+    dos_date: int
+
+    @property
+    def zip64(self) -> bool:
+        return self.size >= ZIP64_LIMIT
+
+    @property
+    def header_size(self) -> int:
+        return 30 + len(self.name) + (20 if self.zip64 else 0)
+
+    @property
+    def descriptor_size(self) -> int:
+        return 24 if self.zip64 else 16
+
+    @property
+    def central_extra(self) -> List[int]:
+        """ZIP64 extra field values of the central directory entry."""
+        values = [self.size, self.size] if self.zip64 else []
+        if self.offset >= ZIP64_LIMIT:
+            values.append(self.offset)
+        return values
+
+    @property
+    def central_size(self) -> int:
+        extra = self.central_extra
+        return 46 + len(self.name) + (4 + 8 * len(extra) if extra else 0)
+
+
+def dos_datetime(timestamp: int):
+    moment = datetime.datetime.fromtimestamp(max(timestamp, 315532800), datetime.timezone.utc)
+    return (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2), \
+        ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day
+
+
+class ZipBundle:
+    """
+    Layout of a stored (uncompressed) ZIP archive of files of known sizes.
+
+    Every byte except the CRCs is known upfront, so the exact length can be
+    sent before the data. CRCs go to the data descriptor after each member and
+    to the central directory at the end. ZIP64 records are used only where
+    sizes, offsets or the member count need them.
+    """
+
+    def __init__(self, files: List[tuple]):
+        """`files` are (name, size, unix timestamp) tuples, names must be unique."""
+        self.members: List[ZipMember] = []
+        offset = 0
+        for name, size, timestamp in files:
+            dos_time, dos_date = dos_datetime(timestamp)
+            member = ZipMember(name.encode("utf-8"), size, offset, dos_time, dos_date)
+            self.members.append(member)
+            offset += member.header_size + size + member.descriptor_size
+        self.central_offset = offset
+        self.central_size = sum(member.central_size for member in self.members)
+        self.zip64 = len(self.members) >= ZIP64_COUNT_LIMIT or self.central_offset >= ZIP64_LIMIT or \
+            self.central_size >= ZIP64_LIMIT
+
+    @property
+    def content_length(self) -> int:
+        return self.central_offset + self.central_size + (56 + 20 if self.zip64 else 0) + 22
+
+    def local_header(self, member: ZipMember) -> bytes:
+        sizes = (ZIP64_LIMIT, ZIP64_LIMIT) if member.zip64 else (member.size, member.size)
+        extra = struct.pack("<HHQQ", 0x0001, 16, member.size, member.size) if member.zip64 else b""
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, VERSION, FLAGS, 0, member.dos_time, member.dos_date,
+            0, *sizes, len(member.name), len(extra)
+        ) + member.name + extra
+
+    @staticmethod
+    def data_descriptor(member: ZipMember, crc: int) -> bytes:
+        if member.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, crc, member.size, member.size)
+        return struct.pack("<IIII", 0x08074B50, crc, member.size, member.size)
+
+    def central_directory(self, crcs: List[int]) -> bytes:
+        entries = []
+        for member, crc in zip(self.members, crcs):
+            values = member.central_extra
+            extra = struct.pack(f"<HH{len(values)}Q", 0x0001, 8 * len(values), *values) if values else b""
+            entries.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, VERSION, VERSION, FLAGS, 0, member.dos_time, member.dos_date,
+                crc, ZIP64_LIMIT if member.zip64 else member.size, ZIP64_LIMIT if member.zip64 else member.size,
+                len(member.name), len(extra), 0, 0, 0, 0o100644 << 16,
+                ZIP64_LIMIT if member.offset >= ZIP64_LIMIT else member.offset
+            ) + member.name + extra)
+
+        end = b""
+        count = len(self.members)
+        if self.zip64:
+            zip64_end_offset = self.central_offset + self.central_size
+            end += struct.pack(
+                "<IQHHIIQQQQ", 0x06064B50, 44, VERSION, VERSION, 0, 0, count, count,
+                self.central_size, self.central_offset
+            )
+            end += struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1)
+        end += struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+            min(self.central_size, ZIP64_LIMIT), min(self.central_offset, ZIP64_LIMIT), 0
+        )
+        return b"".join(entries) + end
+
+
+def unique_names(names: List[str]) -> List[str]:
+    """Flattens the names to the archive root and numbers duplicates, "a.mp4" then "a (1).mp4"."""
+    seen = set()
+    result = []
+    for name in names:
+        name = name.replace("/", "_").replace("\\", "_").lstrip(".") or "file"
+        root, extension = os.path.splitext(name)
+        candidate, number = name, 0
+        while candidate.lower() in seen:
+            number += 1
+            candidate = f"{root} ({number}){extension}"
+        seen.add(candidate.lower())
+        result.append(candidate)
+    return result
@@ -28,4 +28,35 @@ class Var(object):
     DATABASE_URL = str(getenv('DATABASE_URL'))
     PING_INTERVAL = int(getenv('PING_INTERVAL', '500'))
     UPDATES_CHANNEL = str(getenv('UPDATES_CHANNEL', None))
+    MEDIA_SESSIONS_PER_DC = int(getenv('MEDIA_SESSIONS_PER_DC', '2'))
+    SESSION_HEALTH_CHECK_INTERVAL = int(getenv('SESSION_HEALTH_CHECK_INTERVAL', '60'))
+    METADATA_CACHE_SIZE = int(getenv('METADATA_CACHE_SIZE', '1024'))
+    METADATA_CACHE_TTL = int(getenv('METADATA_CACHE_TTL', '1800'))
+    METADATA_CACHE_STALE_TTL = int(getenv('METADATA_CACHE_STALE_TTL', '1800'))
+    PREFETCH_CHUNKS = int(getenv('PREFETCH_CHUNKS', '4'))
+    FIRST_CHUNK_SIZE = int(getenv('FIRST_CHUNK_SIZE', '128'))
+    MAX_CONCURRENT_FETCHES = int(getenv('MAX_CONCURRENT_FETCHES', '32'))
+    PLAYBACK_RATE_LIMIT = int(getenv('PLAYBACK_RATE_LIMIT', '0'))
+    DOWNLOAD_RATE_LIMIT = int(getenv('DOWNLOAD_RATE_LIMIT', '0'))
+    CHUNK_RETRIES = int(getenv('CHUNK_RETRIES', '4'))
+    BREAKER_THRESHOLD = int(getenv('BREAKER_THRESHOLD', '5'))
+    BREAKER_COOLDOWN = int(getenv('BREAKER_COOLDOWN', '30'))
+    MEMBERSHIP_CACHE_TTL = int(getenv('MEMBERSHIP_CACHE_TTL', '600'))
+    MEMBERSHIP_NEGATIVE_TTL = int(getenv('MEMBERSHIP_NEGATIVE_TTL', '10'))
+    KNOWN_USERS_CACHE_SIZE = int(getenv('KNOWN_USERS_CACHE_SIZE', '100000'))
+    BROADCAST_RATE = int(getenv('BROADCAST_RATE', '25'))
+    BROADCAST_CONCURRENCY = int(getenv('BROADCAST_CONCURRENCY', '10'))
+    BROADCAST_BATCH_SIZE = int(getenv('BROADCAST_BATCH_SIZE', '500'))
+    INGEST_QUEUE_SIZE = int(getenv('INGEST_QUEUE_SIZE', '1000'))
+    INGEST_WORKERS = int(getenv('INGEST_WORKERS', '2'))
+    INGEST_RATE = int(getenv('INGEST_RATE', '20'))
+    PROCESSES = int(getenv('PROCESSES', '1'))
+    # Set by the supervisor for each worker process, worker 0 handles the bot updates
+    WORKER_INDEX = int(getenv('WORKER_INDEX', '0'))
+    CHUNK_ORIGIN_URL = str(getenv('CHUNK_ORIGIN_URL', ''))
+    BUNDLE_MAX_FILES = int(getenv('BUNDLE_MAX_FILES', '50'))
+    CACHE_DIR = str(getenv('CACHE_DIR', 'cache'))
+    CACHE_MAX_SIZE = int(getenv('CACHE_MAX_SIZE', '2048'))
+    THUMB_MEMORY_CACHE_SIZE = int(getenv('THUMB_MEMORY_CACHE_SIZE', '32'))
+    THUMB_CACHE_SIZE = int(getenv('THUMB_CACHE_SIZE', '256'))
     BANNED_CHANNELS = list(set(int(x) for x in str(getenv("BANNED_CHANNELS", "-1001362659779")).split()))
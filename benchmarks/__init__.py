@@ -0,0 +1,13 @@
+# This file is a part of TG-FileStreamBot
+
+"""
+Streaming benchmarks run against an in-process fake of Telegram, see
+fake_telegram.py. Run them with `python -m benchmarks`.
+"""
+
+import os
+
+# The benchmarks never log in, placeholders let WebStreamer.vars load without a .env
+for name, value in (("API_ID", "1"), ("API_HASH", "benchmark"), ("BOT_TOKEN", "1:benchmark"),
+                    ("BIN_CHANNEL", "-1001"), ("DATABASE_URL", "mongodb://localhost")):
+    os.environ.setdefault(name, value)
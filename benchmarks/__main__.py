@@ -0,0 +1,29 @@
+# This file is a part of TG-FileStreamBot
+
+import asyncio
+import logging
+import argparse
+from benchmarks import micro
+from benchmarks.fake_telegram import MB
+from benchmarks.report import write_results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="ByteStreamer benchmarks against a fake Telegram backend")
+    parser.add_argument("--output", "-o", help="JSON file to write the results to, printed when omitted")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a smoke run")
+    parser.add_argument("--latency", type=float, default=0.05, help="GetFile round-trip time in seconds")
+    parser.add_argument("--bandwidth", type=float, default=50, help="MB/s per DC, 0 for unlimited")
+    parser.add_argument("--window", type=int, default=4, help="prefetch window of the concurrent streams")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    config = {"latency": args.latency, "bandwidth": args.bandwidth * MB, "seed": args.seed}
+    results = asyncio.run(micro.run(config, quick=args.quick, window=args.window))
+    write_results("micro", dict(config, quick=args.quick, window=args.window), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# This file is a part of TG-FileStreamBot
+
+import time
+import random
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Sequence
+from pyrogram import raw
+from pyrogram.errors import FloodWait, InternalServerError, LimitInvalid, OffsetInvalid
+from pyrogram.file_id import FileId, FileType
+from WebStreamer.utils import custom_dl
+from WebStreamer.utils.custom_dl import ByteStreamer
+from WebStreamer.utils.disk_cache import ChunkDiskCache
+from WebStreamer.utils.scheduler import FairScheduler
+from WebStreamer.utils.single_flight import SingleFlight
+from WebStreamer.utils.thumbnail_cache import ThumbnailCache
+
+MB = 1024 * 1024
+# Content of the fake files, a random MB repeated and shifted by the media id.
+# Stored twice so any read of up to a MB is a single slice
+PATTERN = random.Random(0).randbytes(MB) * 2
+
+
+def flood_wait(seconds: int) -> FloodWait:
+    """Builds a FloodWait across Pyrogram versions (1.x takes x, 2.x takes value)."""
+    try:
+        return FloodWait(value=seconds)
+    except TypeError:
+        return FloodWait(x=seconds)
+
+
+class FakeFile:
+    def __init__(self, message_id: int, file_size: int, dc_id: int = 4, mime_type: str = "video/mp4"):
+        self.message_id = message_id
+        self.media_id = 1000 + message_id
+        self.file_size = file_size
+        self.dc_id = dc_id
+        self.mime_type = mime_type
+
+
+class FakeTelegram:
+    """
+    Deterministic stand-in for the Telegram DCs.
+
+    upload.GetFile answers after `latency` seconds plus the transfer time of the
+    data over a link of `bandwidth` bytes per second shared by all requests to
+    a DC (0 for unlimited). `error_rate` of the requests fail with a 500 and
+    `flood_rate` of them with a FloodWait of `flood_wait` seconds, drawn from a
+    seeded generator so runs are repeatable. `faults` scripts the outcome of
+    the first requests ("error" or "flood", None for a normal answer) so short
+    runs see them too. Requests breaking Telegram's offset and limit rules are
+    refused like Telegram would.
+    """
+
+    def __init__(self, latency: float = 0.05, bandwidth: float = 50 * MB, error_rate: float = 0.0,
+                 flood_rate: float = 0.0, flood_wait: int = 1, seed: int = 0,
+                 faults: Sequence[Optional[str]] = ()):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.faults = list(faults)
+        self.random = random.Random(seed)
+        self.files: Dict[int, FakeFile] = {}
+        self._by_media_id: Dict[int, FakeFile] = {}
+        # Time each DC link is busy until
+        self._link_free_at: Dict[int, float] = {}
+        self.requests = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.flood_waits = 0
+
+    def add_file(self, message_id: int, file_size: int, dc_id: int = 4, mime_type: str = "video/mp4") -> FakeFile:
+        file = self.files[message_id] = FakeFile(message_id, file_size, dc_id, mime_type)
+        self._by_media_id[file.media_id] = file
+        return file
+
+    @staticmethod
+    def read(media_id: int, offset: int, length: int) -> bytes:
+        """Content of a fake file, a slice of PATTERN repeated every MB."""
+        parts = []
+        while length > 0:
+            start = (offset + media_id * 4099) % MB
+            size = min(length, MB)
+            parts.append(PATTERN[start:start + size])
+            offset += size
+            length -= size
+        return b"".join(parts)
+
+    def expected(self, message_id: int, offset: int, length: int) -> bytes:
+        file = self.files[message_id]
+        return self.read(file.media_id, offset, max(0, min(length, file.file_size - offset)))
+
+    async def get_file(self, dc_id: int, query: raw.functions.upload.GetFile) -> raw.types.upload.File:
+        self.requests += 1
+        offset, limit = query.offset, query.limit
+        if limit <= 0 or limit % 4096 or MB % limit:
+            raise LimitInvalid()
+        if offset % 4096 or offset // MB != (offset + limit - 1) // MB:
+            raise OffsetInvalid()
+
+        if self.requests <= len(self.faults):
+            fault = self.faults[self.requests - 1]
+        else:
+            draw = self.random.random()
+            fault = "flood" if draw < self.flood_rate else "error" if draw < self.flood_rate + self.error_rate else None
+        if fault == "flood":
+            self.flood_waits += 1
+            raise flood_wait(self.flood_wait)
+        if fault == "error":
+            self.errors += 1
+            await asyncio.sleep(self.latency)
+            raise InternalServerError()
+
+        file = self._by_media_id[query.location.id]
+        data = self.read(file.media_id, offset, max(0, min(limit, file.file_size - offset)))
+        delay = self.latency
+        if self.bandwidth:
+            now = time.monotonic()
+            start = max(now, self._link_free_at.get(dc_id, now))
+            self._link_free_at[dc_id] = start + len(data) / self.bandwidth
+            delay += self._link_free_at[dc_id] - now
+        await asyncio.sleep(delay)
+        self.bytes_sent += len(data)
+        return raw.types.upload.File(type=raw.types.storage.FileUnknown(), mtime=0, bytes=data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "bytes_sent": self.bytes_sent,
+            "errors": self.errors,
+            "flood_waits": self.flood_waits,
+        }
+
+
+class FakeSession:
+    def __init__(self, telegram: FakeTelegram, dc_id: int):
+        self.telegram = telegram
+        self.dc_id = dc_id
+        self.in_flight = 0
+        self.requests = 0
+
+    async def send(self, query, *args, **kwargs):
+        return await self.telegram.get_file(self.dc_id, query)
+
+    invoke = send
+
+
+class FakeSessionPool:
+    """Replaces MediaSessionPool, one fake session per DC."""
+
+    def __init__(self, telegram: FakeTelegram):
+        self.telegram = telegram
+        self.sessions: Dict[int, FakeSession] = {}
+
+    @asynccontextmanager
+    async def acquire(self, dc_id: int):
+        session = self.sessions.setdefault(dc_id, FakeSession(self.telegram, dc_id))
+        session.in_flight += 1
+        session.requests += 1
+        try:
+            yield session
+        finally:
+            session.in_flight -= 1
+
+    async def start_health_checker(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[int, Dict[str, int]]:
+        """Same figures as MediaSessionPool.stats, for /metrics."""
+        return {
+            dc_id: {
+                "sessions": 1,
+                "active": 1 if session.in_flight else 0,
+                "idle": 0 if session.in_flight else 1,
+                "in_flight": session.in_flight,
+                "requests": session.requests,
+                "dropped": 0,
+            }
+            for dc_id, session in self.sessions.items()
+        }
+
+
+class FakeClient:
+    """The parts of pyrogram.Client used by ByteStreamer: its identity and get_messages on the BIN_CHANNEL."""
+
+    def __init__(self, telegram: FakeTelegram, bot_id: int = 1):
+        self.telegram = telegram
+        self.me = SimpleNamespace(id=bot_id)
+        self.bot_token = f"{bot_id}:benchmark"
+
+    async def get_messages(self, chat_id: int, message_ids: int):
+        file = self.telegram.files.get(message_ids)
+        if file is None:
+            return SimpleNamespace(empty=True)
+        file_id = FileId(file_type=FileType.DOCUMENT, dc_id=file.dc_id, media_id=file.media_id, access_hash=0,
+                         file_reference=b"")
+        return SimpleNamespace(empty=False, date=0, document=SimpleNamespace(
+            file_id=file_id.encode(),
+            file_unique_id=f"fake{file.media_id}",
+            file_size=file.file_size,
+            mime_type=file.mime_type,
+            file_name=f"file_{file.message_id}.mp4",
+            thumbs=None
+        ))
+
+
+def make_streamer(telegram: FakeTelegram, disk_cache: Optional[ChunkDiskCache] = None,
+                  concurrency: int = 64) -> ByteStreamer:
+    """
+    A ByteStreamer reading from the fake, with its own scheduler and request
+    coalescing and without the disk cache, the file index or session pool.
+    """
+    streamer = ByteStreamer(
+        FakeClient(telegram),
+        disk_cache=disk_cache or ChunkDiskCache(max_bytes=0),
+        chunk_requests=SingleFlight(),
+        scheduler=FairScheduler(concurrency),
+        file_index=None,
+        thumbnails=ThumbnailCache(tempfile.gettempdir(), disk_bytes=0)
+    )
+    streamer.session_pool = FakeSessionPool(telegram)
+    return streamer
+
+
+@contextmanager
+def serving(streamer: ByteStreamer):
+    """Makes the HTTP routes stream through `streamer` instead of the Telegram clients."""
+    saved = dict(custom_dl.streamers)
+    custom_dl.streamers.clear()
+    custom_dl.streamers[0] = streamer
+    try:
+        yield streamer
+    finally:
+        custom_dl.streamers.clear()
+        custom_dl.streamers.update(saved)
@@ -0,0 +1,271 @@
+# This file is a part of TG-FileStreamBot
+
+"""
+HTTP load test of the streaming routes. The aiohttp app from web_server()
+is started on a local port, backed by the fake Telegram of fake_telegram.py,
+and driven by many concurrent clients replaying access traces, either the
+built-in ones or recorded ones loaded with --traces:
+
+    python -m benchmarks.load --clients 2000 --output load.json
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+from typing import Dict, List, Optional, Union
+import aiohttp
+from aiohttp import web
+from WebStreamer.server import web_server
+from WebStreamer.utils.disk_cache import ChunkDiskCache
+from benchmarks.fake_telegram import MB, FakeTelegram, make_streamer, serving
+from benchmarks.report import mbps, summarize, write_results
+
+# A trace is the list of requests one client makes for a file. "get" is a Range
+# request from `start` to `end` (inclusive, until the end of the file when
+# omitted), abandoned after `read` bytes like a player closing the connection.
+# Positions are bytes, negative ones counting from the end of the file, or
+# fractions of the file size. "split" is a download manager: a HEAD request
+# then the whole file over `connections` parallel ranges.
+TRACES = {
+    # HTML5 <video>: probe the head, fetch the moov at the tail, play, then seek twice
+    "player": [
+        {"op": "get", "start": 0, "read": 64 * 1024},
+        {"op": "get", "start": -256 * 1024},
+        {"op": "get", "start": 0, "read": 4 * MB},
+        {"op": "get", "start": 0.35, "read": 2 * MB},
+        {"op": "get", "start": 0.7, "read": 2 * MB},
+    ],
+    # Scrubbing through the timeline, short reads at many positions
+    "scrubbing": [
+        {"op": "get", "start": 0, "read": 64 * 1024},
+        {"op": "get", "start": -256 * 1024},
+    ] + [{"op": "get", "start": position / 10, "read": 512 * 1024} for position in range(1, 10)],
+    "download_manager": [
+        {"op": "split", "connections": 8},
+    ],
+}
+
+
+def resolve(position: Union[int, float], file_size: int) -> int:
+    if isinstance(position, float):
+        return int(position * file_size)
+    return max(0, file_size + position) if position < 0 else min(position, file_size - 1)
+
+
+def current_rss() -> int:
+    """Resident set size in bytes, read from /proc on Linux."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ScenarioStats:
+    def __init__(self):
+        self.ttfb: List[float] = []
+        self.bytes = 0
+        self.requests = 0
+        self.errors: Dict[str, int] = {}
+        self.peak_rss = 0
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class LoadGenerator:
+    def __init__(self, base_url: str, telegram: FakeTelegram, file_ids: List[int], file_size: int,
+                 verify: bool = False, seed: int = 0):
+        self.base_url = base_url
+        self.telegram = telegram
+        self.file_ids = file_ids
+        self.file_size = file_size
+        self.verify = verify
+        self.random = random.Random(seed)
+        # Popularity follows a Zipf law, the first files get most of the viewers
+        self.weights = [1 / rank for rank in range(1, len(file_ids) + 1)]
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def fetch(self, stats: ScenarioStats, message_id: int, start: int, end: Optional[int],
+                    read: Optional[int]):
+        until = self.file_size - 1 if end is None else end
+        wanted = until - start + 1 if read is None else min(read, until - start + 1)
+        header = f"bytes={start}-" if end is None else f"bytes={start}-{end}"
+        stats.requests += 1
+        started = time.perf_counter()
+        received = 0
+        try:
+            async with self.session.get(f"{self.base_url}/{message_id}", headers={"Range": header}) as response:
+                if response.status != 206:
+                    stats.error(f"status_{response.status}")
+                    return
+                async for chunk in response.content.iter_any():
+                    if not received:
+                        stats.ttfb.append(time.perf_counter() - started)
+                    chunk = chunk[:wanted - received]
+                    if self.verify and chunk != self.telegram.expected(message_id, start + received, len(chunk)):
+                        stats.error("corrupted")
+                        response.close()
+                        return
+                    received += len(chunk)
+                    if received >= wanted:
+                        break
+                if received < wanted:
+                    stats.error("truncated")
+                # Abandoning the rest of the response, like a player does, closes the connection
+                response.close()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            stats.error(type(e).__name__)
+        finally:
+            stats.bytes += received
+
+    async def split_download(self, stats: ScenarioStats, message_id: int, connections: int):
+        stats.requests += 1
+        try:
+            async with self.session.head(f"{self.base_url}/{message_id}") as response:
+                file_size = int(response.headers.get("Content-Length", 0))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            stats.error(type(e).__name__)
+            return
+        if not file_size:
+            stats.error("no_length")
+            return
+        step = -(-file_size // connections)
+        await asyncio.gather(*(
+            self.fetch(stats, message_id, start, min(start + step, file_size) - 1, None)
+            for start in range(0, file_size, step)
+        ))
+
+    async def scrape_metrics(self, stats: ScenarioStats):
+        """Scrapes /metrics like a monitoring system would, failures count as errors."""
+        stats.requests += 1
+        try:
+            async with self.session.get(f"{self.base_url}/metrics") as response:
+                await response.read()
+                if response.status != 200:
+                    stats.error(f"metrics_{response.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            stats.error(type(e).__name__)
+
+    async def client(self, stats: ScenarioStats, trace: List[Dict], delay: float):
+        await asyncio.sleep(delay)
+        message_id = self.random.choices(self.file_ids, self.weights)[0]
+        for step in trace:
+            if step["op"] == "split":
+                await self.split_download(stats, message_id, step.get("connections", 8))
+                continue
+            start = resolve(step.get("start", 0), self.file_size)
+            end = resolve(step["end"], self.file_size) if step.get("end") is not None else None
+            await self.fetch(stats, message_id, start, end, step.get("read"))
+
+    async def run_scenario(self, trace: List[Dict], clients: int, ramp_up: float) -> Dict:
+        stats = ScenarioStats()
+        sampling = True
+
+        async def sample_memory():
+            while sampling:
+                stats.peak_rss = max(stats.peak_rss, current_rss())
+                await asyncio.sleep(0.05)
+
+        sampler = asyncio.ensure_future(sample_memory())
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.client(stats, trace, ramp_up * index / clients) for index in range(clients)
+        ))
+        elapsed = time.perf_counter() - started
+        sampling = False
+        await sampler
+        await self.scrape_metrics(stats)
+        failed = sum(stats.errors.values())
+        return {
+            "clients": clients,
+            "requests": stats.requests,
+            "ttfb": summarize(stats.ttfb),
+            "mbps": mbps(stats.bytes, elapsed),
+            "bytes": stats.bytes,
+            "seconds": round(elapsed, 3),
+            "peak_rss_mb": round(stats.peak_rss / MB, 1),
+            "error_rate": round(failed / stats.requests, 4) if stats.requests else 0.0,
+            "errors": stats.errors,
+        }
+
+
+async def run(args) -> Dict:
+    telegram = FakeTelegram(latency=args.latency, bandwidth=args.bandwidth * MB, error_rate=args.error_rate,
+                            flood_rate=args.flood_rate, seed=args.seed)
+    file_ids = list(range(1, args.files + 1))
+    for message_id in file_ids:
+        telegram.add_file(message_id, args.file_size * MB)
+    disk_cache = None
+    if args.disk_cache:
+        disk_cache = ChunkDiskCache(tempfile.mkdtemp(prefix="webstreamer-load-"), args.disk_cache * MB)
+    streamer = make_streamer(telegram, disk_cache=disk_cache, concurrency=args.fetches)
+
+    traces = TRACES
+    if args.traces:
+        with open(args.traces) as f:
+            traces = json.load(f)
+    scenarios = args.scenarios or list(traces)
+
+    runner = web.AppRunner(await web_server())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, backlog=4096)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    results = {}
+    try:
+        with serving(streamer):
+            generator = LoadGenerator(f"http://{host}:{port}", telegram, file_ids, args.file_size * MB,
+                                      verify=args.verify, seed=args.seed)
+            timeout = aiohttp.ClientTimeout(total=args.timeout)
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+                generator.session = session
+                for name in scenarios:
+                    results[name] = await generator.run_scenario(traces[name], args.clients, args.ramp_up)
+                    logging.info(f"{name}: {results[name]}")
+    finally:
+        await runner.cleanup()
+    results["backend"] = telegram.stats()
+    results["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load",
+                                     description="HTTP load test replaying player access traces")
+    parser.add_argument("--output", "-o", help="JSON file to write the results to, printed when omitted")
+    parser.add_argument("--clients", type=int, default=200, help="clients per scenario")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="seconds over which the clients start")
+    parser.add_argument("--scenarios", nargs="*", help="scenarios to run, all of them by default")
+    parser.add_argument("--traces", help="JSON file of recorded traces, keyed by scenario name")
+    parser.add_argument("--files", type=int, default=20, help="distinct files watched")
+    parser.add_argument("--file-size", type=int, default=64, help="file size in MB")
+    parser.add_argument("--latency", type=float, default=0.05, help="GetFile round-trip time in seconds")
+    parser.add_argument("--bandwidth", type=float, default=100, help="MB/s per DC, 0 for unlimited")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of GetFile requests failing")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of GetFile requests hit by FloodWait")
+    parser.add_argument("--fetches", type=int, default=64, help="concurrent GetFile requests allowed")
+    parser.add_argument("--disk-cache", type=int, default=0, help="chunk cache size in MB, disabled by default")
+    parser.add_argument("--timeout", type=float, default=300, help="per request timeout in seconds")
+    parser.add_argument("--verify", action="store_true", help="compare every byte with the fake's content")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args()
+
+    # Abandoned responses are logged by the routes, only keep the load test's own output
+    logging.basicConfig(level=logging.CRITICAL)
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+    results = asyncio.run(run(args))
+    config = {name: value for name, value in vars(args).items() if name not in ("output", "verbose")}
+    write_results("load", config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
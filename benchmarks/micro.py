@@ -0,0 +1,163 @@
+# This file is a part of TG-FileStreamBot
+
+import time
+import asyncio
+from typing import Dict, List, Tuple
+from aiohttp.test_utils import TestClient, TestServer
+from WebStreamer.server import web_server
+from benchmarks.fake_telegram import MB, FakeTelegram, make_streamer, serving
+from benchmarks.report import mbps, summarize
+
+
+async def bench_yield_file(telegram: FakeTelegram, chunks: int) -> Dict:
+    """Sequential 1 MB yield_file calls on one file, each one a GetFile round-trip."""
+    telegram.add_file(1, chunks * MB)
+    streamer = make_streamer(telegram)
+    await streamer.get_file_properties(1)
+    latencies = []
+    started = time.perf_counter()
+    for index in range(chunks):
+        begin = time.perf_counter()
+        await streamer.yield_file(1, index * MB, MB)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    return {"chunk": summarize(latencies), "mbps": mbps(chunks * MB, elapsed)}
+
+
+async def bench_chunk_overhead(chunks: int) -> Dict:
+    """
+    yield_file against a fake answering instantly: what is left is the cost of
+    the streamer itself, scheduler, request coalescing and metrics included.
+    """
+    telegram = FakeTelegram(latency=0, bandwidth=0)
+    telegram.add_file(1, MB)
+    streamer = make_streamer(telegram)
+    await streamer.get_file_properties(1)
+    started = time.perf_counter()
+    for index in range(chunks):
+        await streamer.yield_file(1, (index % 256) * 4096, 4096)
+    elapsed = time.perf_counter() - started
+    return {"calls": chunks, "per_call_us": round(elapsed / chunks * 1e6, 2)}
+
+
+async def read_stream(streamer, message_id: int, file_size: int, window: int) -> Tuple[float, int]:
+    """Reads a whole file through prefetch_file, returns the time to the first chunk and the byte count."""
+    started = time.perf_counter()
+    ttfb = None
+    received = 0
+    parts = streamer.plan_file(await streamer.get_file_properties(message_id), 0, file_size - 1)
+    chunks = streamer.prefetch_file(message_id, parts, window=window)
+    try:
+        async for chunk in chunks:
+            if ttfb is None:
+                ttfb = time.perf_counter() - started
+            received += len(chunk)
+    finally:
+        await chunks.aclose()
+    return ttfb, received
+
+
+async def bench_prefetch(config: Dict, file_size: int, windows: List[int]) -> Dict:
+    """Whole file reads through prefetch_file for several window sizes."""
+    results = {}
+    for window in windows:
+        telegram = FakeTelegram(**config)
+        telegram.add_file(1, file_size)
+        streamer = make_streamer(telegram)
+        started = time.perf_counter()
+        ttfb, received = await read_stream(streamer, 1, file_size, window)
+        elapsed = time.perf_counter() - started
+        results[f"window_{window}"] = {"ttfb_ms": round(ttfb * 1000, 3), "mbps": mbps(received, elapsed)}
+    return results
+
+
+async def bench_concurrency(config: Dict, file_size: int, levels: List[int], window: int) -> Dict:
+    """Concurrent streams of distinct files on one DC, sharing the fake's link."""
+    results = {}
+    for level in levels:
+        telegram = FakeTelegram(**config)
+        for message_id in range(1, level + 1):
+            telegram.add_file(message_id, file_size)
+        streamer = make_streamer(telegram)
+        started = time.perf_counter()
+        streams = await asyncio.gather(*(
+            read_stream(streamer, message_id, file_size, window) for message_id in range(1, level + 1)
+        ))
+        elapsed = time.perf_counter() - started
+        results[f"streams_{level}"] = {
+            "ttfb": summarize([ttfb for ttfb, _ in streams]),
+            "mbps": mbps(sum(received for _, received in streams), elapsed),
+        }
+    return results
+
+
+async def bench_media_streamer(config: Dict, file_size: int, levels: List[int]) -> Dict:
+    """Concurrent GETs of whole files and of 1 MB ranges through the aiohttp app."""
+    results = {}
+    for level in levels:
+        telegram = FakeTelegram(**config)
+        for message_id in range(1, level + 1):
+            telegram.add_file(message_id, file_size)
+        client = TestClient(TestServer(await web_server()))
+        await client.start_server()
+        try:
+            with serving(make_streamer(telegram)):
+                middle = f"bytes={file_size // 2}-{file_size // 2 + MB - 1}"
+                for name, headers in (("full", {}), ("range", {"Range": middle})):
+                    async def fetch(message_id):
+                        started = time.perf_counter()
+                        async with client.get(f"/{message_id}", headers=headers) as response:
+                            first = await response.content.readany()
+                            ttfb = time.perf_counter() - started
+                            received = len(first)
+                            async for chunk in response.content.iter_any():
+                                received += len(chunk)
+                        return ttfb, received
+
+                    started = time.perf_counter()
+                    requests = await asyncio.gather(*(fetch(message_id) for message_id in range(1, level + 1)))
+                    elapsed = time.perf_counter() - started
+                    results[f"{name}_clients_{level}"] = {
+                        "ttfb": summarize([ttfb for ttfb, _ in requests]),
+                        "mbps": mbps(sum(received for _, received in requests), elapsed),
+                    }
+                # Scraped with the fake's session pool in place, it must expose the same stats
+                async with client.get("/metrics") as response:
+                    await response.read()
+                    if response.status != 200:
+                        raise RuntimeError(f"/metrics answered {response.status}")
+        finally:
+            await client.close()
+    return results
+
+
+async def bench_faults(config: Dict, file_size: int, window: int, error_rate: float, flood_rate: float) -> Dict:
+    """
+    A whole file read while the fake injects server errors and FloodWaits, retries included.
+    The first two requests always fail, one of each, so short runs measure the recovery too.
+    """
+    telegram = FakeTelegram(**dict(config, error_rate=error_rate, flood_rate=flood_rate,
+                                   faults=["error", "flood"]))
+    telegram.add_file(1, file_size)
+    streamer = make_streamer(telegram)
+    started = time.perf_counter()
+    ttfb, received = await read_stream(streamer, 1, file_size, window)
+    elapsed = time.perf_counter() - started
+    if not telegram.errors or not telegram.flood_waits:
+        raise RuntimeError(f"No fault was injected: {telegram.stats()}")
+    return dict(telegram.stats(), ttfb_ms=round(ttfb * 1000, 3), mbps=mbps(received, elapsed),
+                complete=received == file_size)
+
+
+async def run(config: Dict, quick: bool = False, window: int = 4) -> Dict:
+    """Runs every micro-benchmark, `quick` shrinks the sizes for a smoke run."""
+    file_size = (8 if quick else 64) * MB
+    levels = [1, 4] if quick else [1, 4, 16, 64]
+    return {
+        "yield_file": await bench_yield_file(FakeTelegram(**config), 8 if quick else 32),
+        "chunk_overhead": await bench_chunk_overhead(1000 if quick else 20000),
+        "prefetch": await bench_prefetch(config, file_size, [1, 4, 8]),
+        "concurrency": await bench_concurrency(config, (4 if quick else 16) * MB, levels, window),
+        "media_streamer": await bench_media_streamer(config, (4 if quick else 16) * MB, levels),
+        "faults": await bench_faults(config, file_size, window, error_rate=0.05, flood_rate=0.01),
+    }
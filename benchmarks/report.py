@@ -0,0 +1,63 @@
+# This file is a part of TG-FileStreamBot
+
+import sys
+import json
+import time
+import platform
+import subprocess
+from typing import Dict, List, Optional
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, 0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    """Latency distribution in milliseconds."""
+    return {
+        "count": len(seconds),
+        "mean_ms": round(sum(seconds) / len(seconds) * 1000, 3) if seconds else 0.0,
+        "p50_ms": round(percentile(seconds, 50) * 1000, 3),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 3),
+        "p99_ms": round(percentile(seconds, 99) * 1000, 3),
+        "max_ms": round(max(seconds) * 1000, 3) if seconds else 0.0,
+    }
+
+
+def mbps(byte_count: int, seconds: float) -> float:
+    """Megabits per second."""
+    return round(byte_count * 8 / seconds / 1e6, 2) if seconds > 0 else 0.0
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(suite: str, config: Dict, results: Dict, output: Optional[str] = None) -> Dict:
+    """
+    Writes the results with what is needed to compare runs: the commit, the
+    interpreter and the fake's configuration. Prints them without `output`.
+    """
+    document = {
+        "suite": suite,
+        "commit": git_commit(),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    text = json.dumps(document, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+    return document